@@ -0,0 +1,171 @@
+import math
+import os
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+from time import monotonic, time
+
+from dotenv import load_dotenv
+from flask import g, request
+from prometheus_client import Counter, Gauge
+
+
+load_dotenv()
+
+
+'''
+Admission control
+    ADMISSION_MAX_IN_FLIGHT requests are handled at once per worker (0, the
+    default, for no limit); the others wait for a slot up to
+    ADMISSION_SLOT_TIMEOUT_MS and are then rejected with 503
+    with ADMISSION_MAX_QUEUE_WAIT_MS set (0, the default, to disable it), a
+    request whose X-Request-Start header (set by the proxy) shows it has
+    already waited longer is rejected at once; only enable it behind a proxy
+    that sets the header and a clock in sync with the workers
+    both checks run before the token is verified or the database queried
+    ADMISSION_SUBJECT_RATE requests per second are allowed per token subject
+    (the sub claim), with bursts of ADMISSION_SUBJECT_BURST, above which
+    requests get 429 (0, the default, for no quota); the quota is per worker
+    /health and /metrics are never rejected, so the monitoring keeps working
+'''
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 0))
+ADMISSION_SLOT_TIMEOUT_MS = float(os.environ.get("ADMISSION_SLOT_TIMEOUT_MS", 500))
+ADMISSION_MAX_QUEUE_WAIT_MS = float(os.environ.get("ADMISSION_MAX_QUEUE_WAIT_MS", 0))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+ADMISSION_SUBJECT_RATE = float(os.environ.get("ADMISSION_SUBJECT_RATE", 0))
+ADMISSION_SUBJECT_BURST = int(os.environ.get("ADMISSION_SUBJECT_BURST", 20))
+ADMISSION_MAX_SUBJECTS = int(os.environ.get("ADMISSION_MAX_SUBJECTS", 10000))
+
+EXEMPT_PATHS = ("/health", "/metrics")
+
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled.", multiprocess_mode="livesum")
+REJECTED = Counter("http_requests_rejected", "Requests rejected by admission control.", ["reason"])
+
+
+class Overloaded(Exception):
+    """A request rejected by admission control, answered with status_code and a Retry-After header."""
+
+    def __init__(self, status_code, description, retry_after):
+        self.status_code = status_code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    """Token buckets per subject, the least recently seen dropped beyond maxsize."""
+
+    def __init__(self, rate, burst, maxsize=ADMISSION_MAX_SUBJECTS):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, subject):
+        """Takes a token of subject, returns 0 or the seconds until one is available."""
+        now = monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(subject, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self._buckets[subject] = (tokens - 1 if not wait else tokens, now)
+            self._buckets.move_to_end(subject)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, slot_timeout_ms=ADMISSION_SLOT_TIMEOUT_MS,
+                 max_queue_wait_ms=ADMISSION_MAX_QUEUE_WAIT_MS,
+                 subject_rate=ADMISSION_SUBJECT_RATE, subject_burst=ADMISSION_SUBJECT_BURST):
+        self._lock = Lock()
+        self.configure(max_in_flight, slot_timeout_ms, max_queue_wait_ms, subject_rate, subject_burst)
+
+    def configure(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, slot_timeout_ms=ADMISSION_SLOT_TIMEOUT_MS,
+                  max_queue_wait_ms=ADMISSION_MAX_QUEUE_WAIT_MS,
+                  subject_rate=ADMISSION_SUBJECT_RATE, subject_burst=ADMISSION_SUBJECT_BURST):
+        self.max_in_flight = max_in_flight
+        self.slot_timeout = slot_timeout_ms / 1000
+        self.max_queue_wait = max_queue_wait_ms / 1000
+        self._slots = BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+        self.buckets = TokenBuckets(subject_rate, subject_burst) if subject_rate > 0 else None
+        with self._lock:
+            self.in_flight = 0
+            self.admitted = 0
+            self.rejected = {"in_flight": 0, "queue_wait": 0, "quota": 0}
+
+    def reject(self, reason, status_code, description, retry_after):
+        with self._lock:
+            self.rejected[reason] += 1
+        REJECTED.labels(reason).inc()
+        raise Overloaded(status_code, description, retry_after)
+
+    def admit(self, request_start=None):
+        """Takes an in-flight slot for the current request, or raises Overloaded."""
+        if self.max_queue_wait and request_start is not None and time() - request_start > self.max_queue_wait:
+            self.reject("queue_wait", 503, "The server is overloaded, retry later.", ADMISSION_RETRY_AFTER)
+        if self._slots is not None and not self._slots.acquire(timeout=self.slot_timeout):
+            self.reject("in_flight", 503, "The server is overloaded, retry later.", ADMISSION_RETRY_AFTER)
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        IN_FLIGHT.inc()
+        return self._slots
+
+    def release(self, slots):
+        with self._lock:
+            self.in_flight -= 1
+        IN_FLIGHT.dec()
+        if slots is not None:
+            slots.release()
+
+    def charge(self, subject):
+        """Takes a request from the quota of subject, or raises Overloaded with 429."""
+        if self.buckets is None or subject is None:
+            return
+        wait = self.buckets.take(subject)
+        if wait:
+            self.reject("quota", 429, "Too many requests, retry later.", math.ceil(wait))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+
+
+admission = AdmissionController()
+
+
+def parse_request_start(value):
+    """The time in seconds of an X-Request-Start header (t=<seconds, ms or us>), or None."""
+    if not value:
+        return None
+    try:
+        start = float(value.strip().removeprefix("t="))
+    except ValueError:
+        return None
+    # Proxies send seconds (nginx), milliseconds (Heroku, Render) or microseconds (Apache)
+    while start > 1e11:
+        start /= 1000
+    return start
+
+
+def init_admission(app):
+    """Admits each request before the other hooks and the views, releases its slot once it is handled."""
+
+    @app.before_request
+    def admit_request():
+        if request.path in EXEMPT_PATHS:
+            return
+        # The previous slot object is kept, so a configure() during the request releases the right one
+        g.admission_slots = admission.admit(parse_request_start(request.headers.get("X-Request-Start")))
+        g.admitted = True
+
+    @app.teardown_request
+    def release_request(exception=None):
+        if g.pop("admitted", False):
+            admission.release(g.pop("admission_slots"))
@@ -0,0 +1,30 @@
+"""add external ids
+
+Revision ID: 3c9e1b7a5d42
+Revises: 8f7d41994a20
+Create Date: 2026-10-17 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1b7a5d42'
+down_revision = '8f7d41994a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('movies', sa.Column('external_id', sa.String(), nullable=True))
+    op.create_index('ix_movies_external_id', 'movies', ['external_id'], unique=True)
+    op.add_column('actors', sa.Column('external_id', sa.String(), nullable=True))
+    op.create_index('ix_actors_external_id', 'actors', ['external_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_actors_external_id', table_name='actors')
+    op.drop_column('actors', 'external_id')
+    op.drop_index('ix_movies_external_id', table_name='movies')
+    op.drop_column('movies', 'external_id')
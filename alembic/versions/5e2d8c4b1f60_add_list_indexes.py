@@ -0,0 +1,31 @@
+"""add indexes for filtering and sorting
+
+Revision ID: 5e2d8c4b1f60
+Revises: a71f0c2d9e83
+Create Date: 2026-10-17 13:27:05.481337
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2d8c4b1f60'
+down_revision = 'a71f0c2d9e83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actors_movie_id', 'actors', ['movie_id'])
+    op.create_index('ix_actors_name', 'actors', ['name'])
+    op.create_index('ix_actors_age', 'actors', ['age'])
+    op.create_index('ix_movies_release_date', 'movies', ['release_date'])
+    op.create_index('ix_movies_title', 'movies', ['title'])
+
+
+def downgrade():
+    op.drop_index('ix_movies_title', table_name='movies')
+    op.drop_index('ix_movies_release_date', table_name='movies')
+    op.drop_index('ix_actors_age', table_name='actors')
+    op.drop_index('ix_actors_name', table_name='actors')
+    op.drop_index('ix_actors_movie_id', table_name='actors')
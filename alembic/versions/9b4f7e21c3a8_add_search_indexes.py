@@ -0,0 +1,60 @@
+"""add trigram search indexes
+
+Revision ID: 9b4f7e21c3a8
+Revises: 5e2d8c4b1f60
+Create Date: 2026-10-17 15:02:19.906452
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4f7e21c3a8'
+down_revision = '5e2d8c4b1f60'
+branch_labels = None
+depends_on = None
+
+
+SEARCHED_COLUMNS = {'actors': 'name', 'movies': 'title'}
+
+
+def sqlite_has_trigram(bind):
+    # The trigram tokenizer needs FTS5 and SQLite 3.34, search falls back to LIKE without the tables
+    if bind.dialect.dbapi.sqlite_version_info < (3, 34, 0):
+        return False
+    return bool(bind.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in SEARCHED_COLUMNS.items():
+            op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm '
+                       f'ON {table} USING gin (lower({column}) gin_trgm_ops)')
+    elif dialect == 'sqlite' and sqlite_has_trigram(op.get_bind()):
+        for table, column in SEARCHED_COLUMNS.items():
+            fts = f'{table}_fts'
+            op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                       f"{column}, content='{table}', content_rowid='id', tokenize='trigram')")
+            op.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+                       f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            op.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+            op.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                       f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            # Index the rows that existed before the table
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table, column in SEARCHED_COLUMNS.items():
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_trgm')
+    elif dialect == 'sqlite':
+        for table in SEARCHED_COLUMNS:
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{trigger}')
+            op.execute(f'DROP TABLE IF EXISTS {table}_fts')
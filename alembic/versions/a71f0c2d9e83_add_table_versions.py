@@ -0,0 +1,32 @@
+"""add table versions
+
+Revision ID: a71f0c2d9e83
+Revises: 3c9e1b7a5d42
+Create Date: 2026-10-17 11:04:52.630914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a71f0c2d9e83'
+down_revision = '3c9e1b7a5d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+    )
+    op.bulk_insert(table_versions, [
+        {'name': 'actors', 'version': 0},
+        {'name': 'movies', 'version': 0},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -1,22 +1,237 @@
-
+import json
+import os
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import date
+from functools import wraps
+from hashlib import sha256
 from dotenv import load_dotenv
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, g, request, abort, jsonify, make_response, stream_with_context
 from flask_cors import CORS
-from auth.auth import AuthError, requires_auth
-from database.models import Actor, Movie
-from database.models import setup_db
+from sqlalchemy import and_, or_, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import load_only, selectinload
+from admission.admission import Overloaded, admission, init_admission
+from auth.auth import AuthError, requires_auth, token_cache
+from cache.cache import response_cache
+from compression.compression import compress_response
+from database.models import Actor, Movie, db, get_table_versions, serializer, update_row
+from database.models import DB_STARTUP, database_path, setup_db
+from database.pool import pool_stats
+from database.routing import DATABASE_REPLICA_URLS, replica_set
+from database import exporter
+from database.importer import import_command
+from database.search import search
+from json_provider.json_provider import JSON_DATE_FORMAT, JSON_ENCODER, FastJSONProvider
+from metrics.metrics import init_metrics, render_metrics
 
 load_dotenv()
 
-ITEMS_PER_PAGE = 10
+ITEMS_PER_PAGE = int(os.environ.get("ITEMS_PER_PAGE", 10))
+MAX_ITEMS_PER_PAGE = int(os.environ.get("MAX_ITEMS_PER_PAGE", 100))
+MAX_PAGE = int(os.environ.get("MAX_PAGE", 10000))
+MAX_BULK_ITEMS = int(os.environ.get("MAX_BULK_ITEMS", 10000))
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 500))
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+ACTOR_SORTS = {"id": Actor.id, "name": Actor.name, "age": Actor.age}
+MOVIE_SORTS = {"id": Movie.id, "title": Movie.title, "release_date": Movie.release_date}
+# Integers the databases can bind (64-bit), larger ones overflow in the driver
+DB_INTEGERS = range(-2 ** 63, 2 ** 63)
+
+Sort = namedtuple("Sort", ["name", "column", "descending"])
 
 # Helper functions
-def paginate(request, items):
-    """Paginates given items according to the page number from the request."""
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * ITEMS_PER_PAGE
-    end = start + ITEMS_PER_PAGE
-    return [item.format() for item in items[start:end]]
+def get_per_page(request):
+    """Gets the page size from the request, bounded by MAX_ITEMS_PER_PAGE."""
+    per_page = request.args.get("per_page", ITEMS_PER_PAGE, type=int)
+    return min(max(per_page, 1), MAX_ITEMS_PER_PAGE)
+
+def get_page(request):
+    """Gets the page number from the request, at most MAX_PAGE."""
+    page = max(request.args.get("page", 1, type=int), 1)
+    # Past it the OFFSET gets slow, then overflows the database integers
+    if page > MAX_PAGE:
+        raise_abort(400, f"page must be at most {MAX_PAGE}.")
+    return page
+
+def paginate(request, query, serialize=None):
+    """Paginates the given query with LIMIT/OFFSET according to the page number from the request."""
+    page = get_page(request)
+    per_page = get_per_page(request)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    if serialize is None:
+        return [item.format() for item in items]
+    return [serialize(item) for item in items]
+
+def encode_cursor(sort, sort_value, item_id):
+    """Encodes the position after the last item of a page as an opaque cursor."""
+    if isinstance(sort_value, date):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort, sort_value, item_id], separators=(",", ":")).encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, sort, sort_column):
+    """Decodes a cursor made by encode_cursor for the same sort, or aborts with 400."""
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, sort_value, item_id = json.loads(raw)
+        python_type = sort_column.type.python_type
+        if sort_value is not None and python_type is date:
+            sort_value = date.fromisoformat(sort_value)
+    except (ValueError, TypeError):
+        raise_abort(400, "Invalid cursor.")
+    if cursor_sort != sort or not is_instance(item_id, int) or item_id not in DB_INTEGERS:
+        raise_abort(400, "Invalid cursor.")
+    # The sort value is compared with the column, a value of another type or out of range would fail in the database
+    if sort_value is not None and not is_instance(sort_value, python_type):
+        raise_abort(400, "Invalid cursor.")
+    if isinstance(sort_value, int) and sort_value not in DB_INTEGERS:
+        raise_abort(400, "Invalid cursor.")
+    return sort_value, item_id
+
+def is_instance(value, python_type):
+    """isinstance() where booleans are not integers, as in JSON."""
+    return isinstance(value, python_type) and not (isinstance(value, bool) and python_type is not bool)
+
+def get_sort(request, columns):
+    """Gets the ?sort= column of a list request, prefixed with - for a descending sort.
+
+    columns maps the sortable names to their columns, the first one being the default.
+    """
+    sort = request.args.get("sort", next(iter(columns)))
+    descending = sort.startswith("-")
+    column = columns.get(sort[1:] if descending else sort)
+    if column is None:
+        raise_abort(400, f"sort must be one of {', '.join(columns)}, optionally prefixed with -.")
+    return Sort(sort, column, descending)
+
+def sort_order(sort, id_column):
+    """ORDER BY clauses of a sort, with NULL sort keys last (first when descending) and the id as tie breaker."""
+    if sort.column is id_column:
+        return [id_column.desc() if sort.descending else id_column]
+    if sort.descending:
+        return [sort.column.desc().nullsfirst(), id_column.desc()]
+    return [sort.column.asc().nullslast(), id_column]
+
+def after_cursor(sort, id_column, sort_value, last_id):
+    """Keyset condition selecting the rows that come after (sort_value, last_id) in sort_order."""
+    after_id = id_column < last_id if sort.descending else id_column > last_id
+    if sort.column is id_column:
+        return after_id
+    if sort_value is None:
+        if sort.descending:
+            return or_(sort.column.isnot(None), and_(sort.column.is_(None), after_id))
+        return and_(sort.column.is_(None), after_id)
+    if sort.descending:
+        return or_(sort.column < sort_value, and_(sort.column == sort_value, after_id))
+    return or_(sort.column > sort_value, and_(sort.column == sort_value, after_id), sort.column.is_(None))
+
+def paginate_by_cursor(request, query, id_column, sort=None, serialize=None):
+    """Paginates the given query with a keyset on (sort column, id_column) after the ?cursor= position.
+
+    Returns the formatted items and the cursor of the next page, or None on the last page.
+    """
+    sort = Sort("id", id_column, False) if sort is None else sort
+    per_page = get_per_page(request)
+    cursor = request.args.get("cursor")
+
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor, sort.name, sort.column)
+        query = query.filter(after_cursor(sort, id_column, sort_value, last_id))
+
+    items = query.order_by(*sort_order(sort, id_column)).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor(sort.name, getattr(last, sort.column.key), getattr(last, id_column.key))
+    if serialize is None:
+        return [item.format() for item in items], next_cursor
+    return [serialize(item) for item in items], next_cursor
+
+def get_name_list(request, name, allowed):
+    """Gets a comma-separated ?name= list of names from allowed, or aborts with 400."""
+    names = {value.strip() for value in request.args[name].split(",")} - {""}
+    if not names <= set(allowed):
+        raise_abort(400, f"{name} must be a comma-separated list of {', '.join(allowed) or 'nothing'}.")
+    return tuple(value for value in allowed if value in names)
+
+def get_projection(request, model, default_include=(), sort=None):
+    """Gets the serializer and loader options for the ?fields= and ?include= of a request.
+
+    ?fields= picks the columns returned (all of model.FIELDS by default) and only those
+    are loaded. ?include= picks the relations embedded, default_include when it is
+    missing and fields aren't restricted, and only those are loaded.
+    """
+    fields = get_name_list(request, "fields", model.FIELDS) if "fields" in request.args else None
+    if fields == ():
+        raise_abort(400, f"fields must be a comma-separated list of {', '.join(model.FIELDS)}.")
+    if "include" in request.args:
+        include = get_name_list(request, "include", tuple(model.RELATIONS))
+    else:
+        include = default_include if fields is None else ()
+
+    options = [selectinload(getattr(model, name)) for name in include]
+    if fields is not None:
+        # The sort column is read to build the next cursor
+        loaded = set(fields) | ({sort.column.key} if sort is not None else set())
+        options.append(load_only(*[getattr(model, field) for field in loaded]))
+    return serializer(model, fields, include), options
+
+def get_int_arg(request, name):
+    """Get an optional integer query parameter, or abort with 400 if it isn't one."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise_abort(400, f"{name} must be an integer.")
+    if value not in DB_INTEGERS:
+        raise_abort(400, f"{name} must be a 64-bit integer.")
+    return value
+
+def get_date_arg(request, name):
+    """Get an optional ISO date query parameter, or abort with 400 if it isn't one."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise_abort(400, f"{name} must be an ISO date (YYYY-MM-DD).")
+
+def filter_actors(request, query):
+    """Applies the movie_id, age_min and age_max filters of the request in SQL."""
+    movie_id = get_int_arg(request, "movie_id")
+    age_min = get_int_arg(request, "age_min")
+    age_max = get_int_arg(request, "age_max")
+    if movie_id is not None:
+        query = query.filter(Actor.movie_id == movie_id)
+    if age_min is not None:
+        query = query.filter(Actor.age >= age_min)
+    if age_max is not None:
+        query = query.filter(Actor.age <= age_max)
+    return query
+
+def filter_movies(request, query):
+    """Applies the released_after and released_before filters of the request in SQL (both inclusive)."""
+    released_after = get_date_arg(request, "released_after")
+    released_before = get_date_arg(request, "released_before")
+    if released_after is not None:
+        query = query.filter(Movie.release_date >= released_after)
+    if released_before is not None:
+        query = query.filter(Movie.release_date <= released_before)
+    return query
+
+def count_requested(request):
+    """Whether the request asks for the total count with ?count=true."""
+    return request.args.get("count", "false").lower() in ("1", "true", "yes")
+
+def count_rows(query):
+    """Counts the rows matched by the given query without loading them."""
+    return query.order_by(None).count()
 
 def raise_abort(status_code, message):
     """Raise an HTTP abort with a custom message."""
@@ -29,32 +244,232 @@ def get_json_body(request):
         raise_abort(400, "Request does not contain a valid JSON body.")
     return body
 
+def make_etag(request, versions, payload=None):
+    """Builds the ETag of a GET response from the request URL, the permissions of the caller and the versions of the tables it reads."""
+    # Responses differ with the permissions, e.g. /search only lists movies to callers allowed to view them
+    scope = " ".join(sorted(payload.get("permissions", ()))) if payload else ""
+    key = "|".join([
+        request.full_path,
+        scope,
+        ",".join(f"{name}={version}" for name, version in sorted(versions.items()))
+    ])
+    return sha256(key.encode()).hexdigest()[:32]
+
+def conditional(*tables):
+    """Adds a strong ETag to the responses of a GET endpoint and answers a matching If-None-Match with 304.
+
+    The ETag only depends on the versions of the given tables, so a 304 is sent
+    without running the endpoint, i.e. without querying rows or serializing JSON.
+    """
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            versions = get_table_versions(tables)
+            # Part of the response cache key, so a write from another worker or process is never served from it
+            g.table_versions = versions
+            etag = make_etag(request, versions, payload)
+            # Weak comparison, so the weak ETags of compressed responses match too
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(f(payload, *args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+    return conditional_decorator
+
+def get_export_format(request):
+    """Get the format of an export request: ndjson (default) or csv."""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        raise_abort(400, "format must be either ndjson or csv.")
+    return fmt
+
+def get_bulk_items(request, key):
+    """Get the items of a bulk request, sent either as a JSON array or as {key: [...]}."""
+    body = get_json_body(request)
+    items = body.get(key) if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        raise_abort(400, f"Request body must contain a non-empty array of {key}.")
+    if len(items) > MAX_BULK_ITEMS:
+        raise_abort(422, f"At most {MAX_BULK_ITEMS} {key} can be created at once.")
+    return items
+
+def get_bulk_mode(request):
+    """Get the error mode of a bulk request: atomic (all-or-nothing, default) or partial."""
+    mode = request.args.get("mode", "atomic")
+    if mode not in ("atomic", "partial"):
+        raise_abort(400, "mode must be either atomic or partial.")
+    return mode
+
+def existing_movie_ids(movie_ids):
+    """Returns which of the given movie ids exist, querying them in batches."""
+    movie_ids = list(movie_ids)
+    existing = set()
+    for start in range(0, len(movie_ids), BULK_BATCH_SIZE):
+        batch = movie_ids[start:start + BULK_BATCH_SIZE]
+        existing.update(row.id for row in db.session.query(Movie.id).filter(Movie.id.in_(batch)))
+    return existing
+
+def build_actor(item, movie_ids):
+    """Validates one item of a bulk request and returns (actor, None) or (None, error message)."""
+    if not isinstance(item, dict):
+        return None, "Item must be a JSON object."
+    name = item.get("name")
+    age = item.get("age")
+    gender = item.get("gender", "Other")
+    movie_id = item.get("movie_id")
+    if not name or not age:
+        return None, "Name and age are required."
+    if not isinstance(name, str) or not isinstance(gender, str):
+        return None, "Name and gender must be strings."
+    if not isinstance(age, int) or isinstance(age, bool):
+        return None, "Age must be an integer."
+    if movie_id is not None and (not isinstance(movie_id, int) or isinstance(movie_id, bool)):
+        return None, "Movie id must be an integer."
+    if movie_id is not None and movie_id not in movie_ids:
+        return None, f"Movie with id {movie_id} not found."
+    return Actor(name=name, age=age, gender=gender, movie_id=movie_id), None
+
+def build_movie(item):
+    """Validates one item of a bulk request and returns (movie, None) or (None, error message)."""
+    if not isinstance(item, dict):
+        return None, "Item must be a JSON object."
+    title = item.get("title")
+    release_date = item.get("release_date")
+    if not title or not release_date:
+        return None, "Title and release date are required."
+    if not isinstance(title, str):
+        return None, "Title must be a string."
+    try:
+        release_date = date.fromisoformat(release_date)
+    except (TypeError, ValueError):
+        return None, "Release date must be an ISO date (YYYY-MM-DD)."
+    return Movie(title=title, release_date=release_date), None
+
+def text_value(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError("must be a non-empty string")
+    return value
+
+def integer_value(value):
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError("must be an integer")
+    return value
+
+def date_value(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError("must be an ISO date (YYYY-MM-DD)")
+
+ACTOR_UPDATES = {"name": text_value, "age": integer_value, "gender": text_value}
+MOVIE_UPDATES = {"title": text_value, "release_date": date_value}
+
+def get_updates(body, fields):
+    """Validates the fields supplied in a PATCH body and returns their new values, other keys are ignored."""
+    values = {}
+    for name, parse in fields.items():
+        if name in body:
+            try:
+                values[name] = parse(body[name])
+            except ValueError as e:
+                raise_abort(422, f"{name} {e}.")
+    return values
+
+def bulk_insert(request, built):
+    """Inserts the valid items of a bulk request in batches within a single transaction.
+
+    built holds one (object, error) pair per input item, as returned by build_actor/build_movie.
+    """
+    errors = [{"index": index, "message": error} for index, (_, error) in enumerate(built) if error]
+    if errors and (get_bulk_mode(request) == "atomic" or len(errors) == len(built)):
+        return jsonify({
+            "success": False,
+            "error": 422,
+            "message": "Some items are invalid, nothing was created.",
+            "errors": errors
+        }), 422
+
+    objects = [obj for obj, _ in built if obj is not None]
+    try:
+        for start in range(0, len(objects), BULK_BATCH_SIZE):
+            db.session.add_all(objects[start:start + BULK_BATCH_SIZE])
+            db.session.flush()
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise_abort(422, "Bulk insert failed, nothing was created.")
+
+    return jsonify({
+        "success": True,
+        "created": [obj.id if obj is not None else None for obj, _ in built],
+        "errors": errors
+    })
+
 def create_app(test_config=None):
     app = Flask(__name__)
-    setup_db(app)
+    if test_config:
+        app.config.from_mapping(test_config)
+    init_metrics(app)
+    init_admission(app)
+    app.json = FastJSONProvider(
+        app,
+        app.config.get("JSON_ENCODER", JSON_ENCODER),
+        app.config.get("JSON_DATE_FORMAT", JSON_DATE_FORMAT)
+    )
+    setup_db(
+        app,
+        app.config.get("SQLALCHEMY_DATABASE_URI", database_path),
+        app.config.get("DATABASE_REPLICA_URLS", DATABASE_REPLICA_URLS),
+        app.config.get("DB_STARTUP", DB_STARTUP)
+    )
     CORS(app)
+    app.cli.add_command(import_command)
 
     @app.after_request
     def after_request(response):
         response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization,true")
         response.headers.add("Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS")
         response.headers.add("Access-Control-Allow-Origin", "*")
-        return response
+        return compress_response(request, response)
 
     # Actor Endpoints
     @app.route('/actors', methods=['GET'])
     @requires_auth('view:actors')
+    @conditional('actors')
+    @response_cache.cached('actors')
     def get_actors(payload):
-        actors = Actor.query.all()
-        paginated_actors = paginate(request, actors)
+        sort = get_sort(request, ACTOR_SORTS)
+        serialize, options = get_projection(request, Actor, sort=sort)
+        actors = filter_actors(request, Actor.query.options(*options))
+        if "cursor" in request.args:
+            paginated_actors, next_cursor = paginate_by_cursor(request, actors, Actor.id, sort, serialize)
+        else:
+            paginated_actors = paginate(request, actors.order_by(*sort_order(sort, Actor.id)), serialize)
 
         if not paginated_actors:
             raise_abort(404, "No actors found in database.")
 
-        return jsonify({
+        response = {
             "success": True,
             "actors": paginated_actors
-        })
+        }
+        if "cursor" in request.args:
+            response["next_cursor"] = next_cursor
+        if count_requested(request):
+            response["total"] = count_rows(actors)
+        return jsonify(response)
+
+    @app.route('/actors/export', methods=['GET'])
+    @requires_auth('view:actors')
+    def export_actors(payload):
+        fmt = get_export_format(request)
+        return Response(stream_with_context(exporter.export_actors(fmt)), mimetype=EXPORT_FORMATS[fmt])
 
     @app.route('/actors', methods=['POST'])
     @requires_auth('create:actors')
@@ -77,25 +492,50 @@ def create_app(test_config=None):
             "created": new_actor.id
         })
 
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('create:actors')
+    def create_actors_bulk(payload):
+        items = get_bulk_items(request, "actors")
+        get_bulk_mode(request)
+
+        # Only integers are looked up, build_actor rejects the other values
+        referenced = {item.get("movie_id") for item in items
+                      if isinstance(item, dict) and isinstance(item.get("movie_id"), int)}
+        movie_ids = existing_movie_ids(referenced)
+
+        return bulk_insert(request, [build_actor(item, movie_ids) for item in items])
+
+    @app.route('/actors/<int:actor_id>', methods=['GET'])
+    @requires_auth('view:actors')
+    @conditional('actors')
+    @response_cache.cached('actors:{actor_id}')
+    def get_actor(payload, actor_id):
+        serialize, options = get_projection(request, Actor)
+        actor = Actor.query.options(*options).filter_by(id=actor_id).one_or_none()
+        if not actor:
+            raise_abort(404, f"Actor with id {actor_id} not found.")
+
+        return jsonify({
+            "success": True,
+            "actor": serialize(actor)
+        })
+
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('edit:actors')
     def update_actor(payload, actor_id):
         body = get_json_body(request)
+        if not isinstance(body, dict):
+            raise_abort(400, "Request body must be a JSON object.")
 
-        actor = Actor.query.filter_by(id=actor_id).one_or_none()
-        if not actor:
+        actor = update_row(Actor, actor_id, get_updates(body, ACTOR_UPDATES))
+        if actor is None:
             raise_abort(404, f"Actor with id {actor_id} not found.")
-
-        actor.name = body.get("name", actor.name)
-        actor.age = body.get("age", actor.age)
-        actor.gender = body.get("gender", actor.gender)
-
-        actor.update()
+        db.session.commit()
 
         return jsonify({
             "success": True,
             "updated": actor.id,
-            "actor": actor.format()
+            "actor": serializer(Actor)(actor)
         })
 
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
@@ -115,17 +555,36 @@ def create_app(test_config=None):
     # Movie Endpoints
     @app.route('/movies', methods=['GET'])
     @requires_auth('view:movies')
+    @conditional('movies', 'actors')
+    @response_cache.cached('movies', 'actors')
     def get_movies(payload):
-        movies = Movie.query.all()
-        paginated_movies = paginate(request, movies)
+        sort = get_sort(request, MOVIE_SORTS)
+        # Included actors are loaded for the whole page with one IN query instead of one query per movie
+        serialize, options = get_projection(request, Movie, ("actors",), sort)
+        movies = filter_movies(request, Movie.query.options(*options))
+        if "cursor" in request.args:
+            paginated_movies, next_cursor = paginate_by_cursor(request, movies, Movie.id, sort, serialize)
+        else:
+            paginated_movies = paginate(request, movies.order_by(*sort_order(sort, Movie.id)), serialize)
 
         if not paginated_movies:
             raise_abort(404, "No movies found in database.")
 
-        return jsonify({
+        response = {
             "success": True,
             "movies": paginated_movies
-        })
+        }
+        if "cursor" in request.args:
+            response["next_cursor"] = next_cursor
+        if count_requested(request):
+            response["total"] = count_rows(movies)
+        return jsonify(response)
+
+    @app.route('/movies/export', methods=['GET'])
+    @requires_auth('view:movies')
+    def export_movies(payload):
+        fmt = get_export_format(request)
+        return Response(stream_with_context(exporter.export_movies(fmt)), mimetype=EXPORT_FORMATS[fmt])
 
     @app.route('/movies', methods=['POST'])
     @requires_auth('create:movies')
@@ -146,24 +605,50 @@ def create_app(test_config=None):
             "created": new_movie.id
         })
 
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('create:movies')
+    def create_movies_bulk(payload):
+        items = get_bulk_items(request, "movies")
+        get_bulk_mode(request)
+
+        return bulk_insert(request, [build_movie(item) for item in items])
+
+    @app.route('/movies/<int:movie_id>', methods=['GET'])
+    @requires_auth('view:movies')
+    @conditional('movies', 'actors')
+    @response_cache.cached('movies:{movie_id}')
+    def get_movie(payload, movie_id):
+        serialize, options = get_projection(request, Movie, ("actors",))
+        movie = Movie.query.options(*options).filter_by(id=movie_id).one_or_none()
+        if not movie:
+            raise_abort(404, f"Movie with id {movie_id} not found.")
+
+        return jsonify({
+            "success": True,
+            "movie": serialize(movie)
+        })
+
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('edit:movies')
     def update_movie(payload, movie_id):
         body = get_json_body(request)
+        if not isinstance(body, dict):
+            raise_abort(400, "Request body must be a JSON object.")
 
-        movie = Movie.query.filter_by(id=movie_id).one_or_none()
-        if not movie:
+        row = update_row(Movie, movie_id, get_updates(body, MOVIE_UPDATES))
+        if row is None:
             raise_abort(404, f"Movie with id {movie_id} not found.")
-
-        movie.title = body.get("title", movie.title)
-        movie.release_date = body.get("release_date", movie.release_date)
-
-        movie.update()
+        movie = serializer(Movie)(row)
+        # The actors in one query on their table, in the transaction of the update
+        actors = db.session.execute(
+            select(Actor.__table__).where(Actor.movie_id == movie_id).order_by(Actor.id))
+        movie["actors"] = [serializer(Actor)(actor) for actor in actors]
+        db.session.commit()
 
         return jsonify({
             "success": True,
-            "edited": movie.id,
-            "movie": movie.format()
+            "edited": movie["id"],
+            "movie": movie
         })
 
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
@@ -180,6 +665,58 @@ def create_app(test_config=None):
             "deleted": movie_id
         })
 
+    # Search Endpoint
+    @app.route('/search', methods=['GET'])
+    @requires_auth('view:actors')
+    @conditional('actors', 'movies')
+    @response_cache.cached('actors', 'movies')
+    def search_names(payload):
+        q = request.args.get("q", "").strip()
+        if not q:
+            raise_abort(400, "Query parameter q is required.")
+
+        per_page = get_per_page(request)
+        offset = (get_page(request) - 1) * per_page
+
+        response = {
+            "success": True,
+            "actors": [actor.format() for actor in search(Actor, q, per_page, offset)]
+        }
+        # Movies are only searched for callers allowed to view them
+        if "view:movies" in payload.get("permissions", []):
+            movies = search(Movie, q, per_page, offset, selectinload(Movie.actors))
+            response["movies"] = [movie.format() for movie in movies]
+        return jsonify(response)
+
+    # Health Endpoint
+    @app.route('/health', methods=['GET'])
+    def health():
+        """Liveness of the database and statistics of the connection pool, the caches and the admission control of this worker."""
+        try:
+            db.session.execute(text("SELECT 1"), bind_arguments={"bind": db.engine})
+            database = "ok"
+        except SQLAlchemyError:
+            database = "unavailable"
+        finally:
+            db.session.remove()
+
+        return jsonify({
+            "success": database == "ok",
+            "database": database,
+            "pool": pool_stats.snapshot(db.engine.pool),
+            "replicas": replica_set.status(),
+            "token_cache": token_cache.stats(),
+            "response_cache": response_cache.stats(),
+            "admission": admission.stats()
+        }), 200 if database == "ok" else 503
+
+    # Metrics Endpoint
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Request metrics in the Prometheus text format, summed over the workers."""
+        body, content_type = render_metrics()
+        return Response(body, content_type=content_type)
+
     # Error Handlers
     def get_error_message(error, default_message):
         """Extracts error message or returns default."""
@@ -211,6 +748,16 @@ def create_app(test_config=None):
             "message": get_error_message(error, "Resource Not Found")
         }), 404
 
+    @app.errorhandler(Overloaded)
+    def overloaded(error):
+        response = jsonify({
+            "success": False,
+            "error": error.status_code,
+            "message": error.description
+        })
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response, error.status_code
+
     @app.errorhandler(AuthError)
     def authentication_failed(error):
         return jsonify({
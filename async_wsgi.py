@@ -0,0 +1,28 @@
+'''
+Cooperative serving mode
+    serves the same app as wsgi.py, with gevent patching sockets, locks and
+    threads so that a worker switches to another request while one waits on
+    the database or on the JWKS fetch
+    psycopg2 is made cooperative by psycogreen, so a worker handles as many
+    concurrent requests as its connection pool allows (DB_POOL_SIZE and
+    DB_MAX_OVERFLOW), bounded by CPU instead of blocking I/O
+
+    gunicorn -k gevent --worker-connections 100 -w 4 async_wsgi:application
+'''
+from gevent import monkey
+
+monkey.patch_all()
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# SQLite databases, used locally, don't need psycopg2
+if psycopg2 is not None:
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+from app import create_app
+
+application = create_app()
@@ -1,13 +1,21 @@
 
+import logging
+from collections import OrderedDict, namedtuple
 from datetime import datetime
+from hashlib import sha256
 from os import environ as env
+from threading import Lock, Thread
+from time import monotonic, perf_counter, time
+from urllib.request import urlopen
 
-from jwt import ExpiredSignatureError, InvalidTokenError, PyJWKClient
 from dotenv import load_dotenv
 from flask import request
 from functools import wraps
 
-import jwt
+import json
+
+from admission.admission import admission
+from metrics.metrics import record_auth_time
 
 
 
@@ -15,8 +23,15 @@ load_dotenv()
 
 
 AUTH0_DOMAIN = env.get("AUTH0_DOMAIN")
-ALGORITHMS = env.get("ALGORITHMS")
+ALGORITHMS = env.get("ALGORITHMS", "RS256")
 API_AUDIENCE = env.get("API_AUDIENCE")
+# Point JWKS_URL at a file:// URL or a local server to run without Auth0
+JWKS_URL = env.get("JWKS_URL", f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+JWKS_CACHE_TTL = int(env.get("JWKS_CACHE_TTL", 600))
+JWKS_MIN_REFRESH_INTERVAL = int(env.get("JWKS_MIN_REFRESH_INTERVAL", 30))
+
+logger = logging.getLogger("capstone.auth")
+TOKEN_CACHE_SIZE = int(env.get("TOKEN_CACHE_SIZE", 1024))
 
 
 ## AuthError Exception
@@ -30,6 +45,166 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+## JWKS Key Store
+
+'''
+JWKSStore
+    process-wide cache of the signing keys published at a JWKS url
+    keys are loaded once and looked up by kid
+    once the ttl has passed the keys are refreshed in a background thread
+        while requests keep using the current keys
+    an unknown kid forces a refetch, at most once per min_refresh_interval,
+        so key rotation is picked up without hammering the provider
+    until a first fetch succeeds, every lookup tries to load the keys, so a
+        worker whose startup fetch failed recovers as soon as the url answers
+'''
+class JWKSStore:
+    def __init__(self, url, ttl=JWKS_CACHE_TTL, min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL, timeout=5):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.fetch_count = 0
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refreshing = False
+        self._lock = Lock()
+        self._fetch_lock = Lock()
+
+    def _fetch(self):
+        from jwt import PyJWKSet
+
+        with urlopen(self.url, timeout=self.timeout) as response:
+            data = json.loads(response.read())
+        self.fetch_count += 1
+        return {key.key_id: key for key in PyJWKSet.from_dict(data).keys}
+
+    def refresh(self, min_interval=0):
+        # Only one thread talks to the provider, the others wait for its result
+        with self._fetch_lock:
+            now = monotonic()
+            if self._last_attempt is not None and now - self._last_attempt < min_interval:
+                return
+            self._last_attempt = now
+            try:
+                keys = self._fetch()
+            except Exception:
+                # Until the keys are loaded once, a failure doesn't hold back the next attempt
+                if self._fetched_at is None:
+                    self._last_attempt = None
+                raise
+            with self._lock:
+                self._keys = keys
+                self._fetched_at = monotonic()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Refreshing the JWKS keys failed, keeping the current keys: %s", e)
+        finally:
+            self._refreshing = False
+
+    def _schedule_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        Thread(target=self._background_refresh, daemon=True).start()
+
+    def get_signing_key(self, kid):
+        if self._fetched_at is None:
+            self.refresh(self.min_refresh_interval)
+        elif monotonic() - self._fetched_at > self.ttl:
+            self._schedule_refresh()
+
+        key = self._keys.get(kid)
+        if key is None:
+            self.refresh(self.min_refresh_interval)
+            key = self._keys.get(kid)
+        if key is None:
+            from jwt import InvalidTokenError
+            raise InvalidTokenError(f"Unable to find a signing key that matches: {kid}")
+        return key
+
+    def get_signing_key_from_jwt(self, token):
+        import jwt
+
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get('kid'))
+
+
+jwks_store = JWKSStore(JWKS_URL)
+
+
+## Verified Token Cache
+
+VerifiedToken = namedtuple('VerifiedToken', ['payload', 'permissions', 'expires_at'])
+
+'''
+TokenCache
+    bounded LRU cache of tokens that already passed verify_decode_jwt
+    entries are keyed by a sha256 of the token, so raw tokens are never kept
+    each entry expires at the exp claim of its token
+    tokens without an exp claim are never cached
+'''
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(token):
+        return sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, token, payload):
+        if self.maxsize <= 0 or 'exp' not in payload:
+            return None
+        entry = VerifiedToken(payload, frozenset(payload.get('permissions', ())), payload['exp'])
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+
+token_cache = TokenCache()
+
+
 ## Auth Header
 
 '''
@@ -73,7 +248,7 @@ def get_token_auth_header():
     it should raise an AuthError if the requested permission string is not in the payload permissions array
     return true otherwise
 '''
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, permissions=None):
     # # Ensure that payload is not None
     if payload is None:
         raise AuthError({
@@ -89,7 +264,10 @@ def check_permissions(permission, payload):
         }, 400)
 
     # Check if the requested permission string is in the payload permissions array
-    if permission not in payload['permissions']:
+    # (or in the permission set of a cached token)
+    if permissions is None:
+        permissions = payload['permissions']
+    if permission not in permissions:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -112,10 +290,13 @@ def check_permissions(permission, payload):
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
+    # jwt loads cryptography, imported on the first verification rather than at startup
+    import jwt
+    from jwt import ExpiredSignatureError, InvalidTokenError
+
     try:
-        # Get the public key from Auth0 JWKS endpoint
-        jwks_client = PyJWKClient(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        # Get the public key from the cached Auth0 JWKS keys
+        signing_key = jwks_store.get_signing_key_from_jwt(token)
 
         # Decode the JWT and validate its signature
         decoded_token = jwt.decode(
@@ -143,6 +324,24 @@ def verify_decode_jwt(token):
         return None
 
 
+'''
+verify_decode_jwt_cached(token)
+    returns the VerifiedToken of a previously verified token
+    or runs verify_decode_jwt and caches its result
+    returns None if the token is invalid
+'''
+def verify_decode_jwt_cached(token):
+    verified = token_cache.get(token)
+    if verified is not None:
+        return verified
+
+    payload = verify_decode_jwt(token)
+    if payload is None:
+        return None
+    return token_cache.put(token, payload) or VerifiedToken(
+        payload, frozenset(payload.get('permissions', ())), payload.get('exp'))
+
+
 '''
 @TODO implement @requires_auth(permission) decorator method
     @INPUTS
@@ -157,10 +356,19 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            started = perf_counter()
+            try:
+                token = get_token_auth_header()
+                verified = verify_decode_jwt_cached(token)
+                if verified is None:
+                    # Raises the invalid payload AuthError
+                    check_permissions(permission, None)
+                check_permissions(permission, verified.payload, verified.permissions)
+                # The quota of the caller, known once the token is verified
+                admission.charge(verified.payload.get('sub'))
+            finally:
+                record_auth_time(perf_counter() - started)
+            return f(verified.payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
@@ -0,0 +1,215 @@
+"""Measures the throughput and latency of every endpoint of the app on a seeded database, offline.
+
+The app runs in-process on DATABASE_URL (a local PostgreSQL), or on a
+temporary SQLite file when it isn't set, seeded with --movies and --actors
+rows. Requests carry an RS256 token signed by a local key and verified
+against a local JWKS, so neither Auth0 nor the network are involved.
+Each endpoint is hit --requests times by --concurrency threads.
+
+The results are printed as JSON lines and written with --output; with
+--compare the run is compared with a previous output, and the script exits
+with status 1 when the p95 of an endpoint grew by more than --max-regression,
+or when an endpoint answered errors in either run, since their latencies
+aren't comparable.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/endpoint_benchmark.py [--actors 10000] [--movies 1000] [--output baseline.json]
+    PYTHONPATH=. python benchmarks/endpoint_benchmark.py --actors 1000000 --movies 100000 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from benchmarks.support import latency_summary, make_local_jwks, mint_token, seed_database
+
+
+'''
+Endpoints
+    name: (method, path, body) of the next request, from a Scenario knowing
+    the id ranges of the seeded rows
+    DELETE requests remove rows inserted for them before the run, so the
+    seeded data is left as it was
+    POST /movies is left out on SQLite, whose Date type rejects the date
+    strings the endpoint receives
+'''
+class Scenario:
+    def __init__(self, app, requests):
+        from database.models import Actor, Movie, db
+
+        with app.app_context():
+            self.dialect = db.engine.dialect.name
+            self.actor_ids = self.id_range(db, Actor)
+            self.movie_ids = self.id_range(db, Movie)
+            self.pages = max(1, (self.actor_ids[1] - self.actor_ids[0] + 1) // 10)
+            self.deleted_actors = iter(self.insert_spare(db, Actor, requests, lambda i: {
+                "name": f"Spare actor {i}", "gender": "F", "age": 30, "movie_id": None}))
+            self.deleted_movies = iter(self.insert_spare(db, Movie, requests, lambda i: {
+                "title": f"Spare movie {i}", "release_date": None}))
+        self.created = count()
+
+    @staticmethod
+    def id_range(db, model):
+        low, high = db.session.query(db.func.min(model.id), db.func.max(model.id)).one()
+        if low is None:
+            raise RuntimeError(f"The {model.__tablename__} table is empty, seed it with --actors and --movies.")
+        return low, high
+
+    @staticmethod
+    def insert_spare(db, model, rows, build):
+        from database.models import record_changes
+
+        first = db.session.query(db.func.max(model.id)).scalar() + 1
+        db.session.execute(model.__table__.insert(), [{"id": first + i, **build(i)} for i in range(rows)])
+        record_changes(db.session, {model.__tablename__})
+        db.session.commit()
+        return range(first, first + rows)
+
+    def actor_id(self):
+        return random.randint(*self.actor_ids)
+
+    def movie_id(self):
+        return random.randint(*self.movie_ids)
+
+    def endpoints(self):
+        endpoints = {
+            "GET /actors": lambda: ("GET", f"/actors?page={random.randint(1, self.pages)}", None),
+            "GET /actors?cursor": lambda: ("GET", "/actors?cursor=&per_page=10", None),
+            "GET /actors/<id>": lambda: ("GET", f"/actors/{self.actor_id()}", None),
+            "GET /actors/export": lambda: ("GET", "/actors/export?format=ndjson", None),
+            "GET /movies": lambda: ("GET", f"/movies?page={random.randint(1, max(1, self.pages // 10))}", None),
+            "GET /movies?fields": lambda: ("GET", "/movies?fields=id,title", None),
+            "GET /movies/<id>": lambda: ("GET", f"/movies/{self.movie_id()}", None),
+            "GET /movies/export": lambda: ("GET", "/movies/export?format=ndjson", None),
+            "GET /search": lambda: ("GET", f"/search?q=Actor+{random.randint(1, 999)}", None),
+            "GET /health": lambda: ("GET", "/health", None),
+            "GET /metrics": lambda: ("GET", "/metrics", None),
+            "POST /actors": lambda: ("POST", "/actors", {
+                "name": f"New actor {next(self.created)}", "gender": "M", "age": 40, "movie_id": self.movie_id()}),
+            "POST /actors/bulk": lambda: ("POST", "/actors/bulk", {"actors": [
+                {"name": f"Bulk actor {next(self.created)}", "gender": "F", "age": 25, "movie_id": self.movie_id()}
+                for _ in range(20)]}),
+            "POST /movies": lambda: ("POST", "/movies", {
+                "title": f"New movie {next(self.created)}", "release_date": "2024-10-05"}),
+            "POST /movies/bulk": lambda: ("POST", "/movies/bulk", {"movies": [
+                {"title": f"Bulk movie {next(self.created)}", "release_date": "2024-10-05"} for _ in range(20)]}),
+            "PATCH /actors/<id>": lambda: ("PATCH", f"/actors/{self.actor_id()}", {"age": random.randint(20, 70)}),
+            "PATCH /movies/<id>": lambda: ("PATCH", f"/movies/{self.movie_id()}", {"title": f"Renamed {next(self.created)}"}),
+            "DELETE /actors/<id>": lambda: ("DELETE", f"/actors/{next(self.deleted_actors)}", None),
+            "DELETE /movies/<id>": lambda: ("DELETE", f"/movies/{next(self.deleted_movies)}", None),
+        }
+        if self.dialect == "sqlite":
+            del endpoints["POST /movies"]
+        return endpoints
+
+
+# Exports stream whole tables, a few requests are enough
+EXPORT_REQUESTS = 5
+
+
+def run_endpoint(app, headers, request, concurrency, requests):
+    def fetch(_):
+        method, path, body = request()
+        started = time.perf_counter()
+        response = app.test_client().open(path, method=method, json=body, headers=headers, buffered=True)
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(fetch, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    summary = latency_summary([latency for latency, _ in results], elapsed)
+    summary["errors"] = sum(1 for _, status in results if status >= 400)
+    return summary
+
+
+def compare(results, baseline, max_regression):
+    """Prints the change of each endpoint against the baseline.
+
+    Returns the endpoints whose p95 regressed and those that answered errors in either run.
+    """
+    regressions, failures = [], []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        # The latencies of error responses say nothing about the endpoint
+        if result["errors"] or previous.get("errors"):
+            print(json.dumps({"endpoint": name, "errors": result["errors"], "baseline_errors": previous.get("errors")}))
+            failures.append(name)
+            continue
+        changes = {key: round((result[key] - previous[key]) / previous[key], 3) if previous[key] else None
+                   for key in ("throughput", "p50_ms", "p95_ms", "p99_ms")}
+        print(json.dumps({"endpoint": name, "change": changes}))
+        if changes["p95_ms"] is not None and changes["p95_ms"] > max_regression:
+            regressions.append(name)
+    return regressions, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--actors", type=int, default=10000)
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint.")
+    parser.add_argument("--endpoints", help="Endpoints to run, separated by commas, all by default.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random ids and pages.")
+    parser.add_argument("--output", help="File to write the JSON results to.")
+    parser.add_argument("--compare", help="Results of a previous run to compare with.")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Largest accepted growth of the p95 of an endpoint against --compare, 0.25 for 25%%.")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        private_key, jwks_url = make_local_jwks(tmpdir)
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{tmpdir}/benchmark.db")
+        os.environ.setdefault("AUTH0_DOMAIN", "benchmark.local")
+        os.environ.setdefault("API_AUDIENCE", "benchmark")
+        os.environ["JWKS_URL"] = jwks_url
+
+        # Imported once the environment points at the local database and keys
+        from app import create_app
+
+        app = create_app()
+        started = time.perf_counter()
+        if seed_database(app, args.movies, args.actors):
+            print(json.dumps({"seeded": {"movies": args.movies, "actors": args.actors},
+                              "seconds": round(time.perf_counter() - started, 1)}))
+        headers = {"Authorization": f"Bearer {mint_token(private_key, os.environ['AUTH0_DOMAIN'], os.environ['API_AUDIENCE'])}"}
+
+        scenario = Scenario(app, args.requests)
+        endpoints = scenario.endpoints()
+        names = args.endpoints.split(",") if args.endpoints else list(endpoints)
+        unknown = [name for name in names if name not in endpoints]
+        if unknown:
+            parser.error(f"Unknown endpoints, or not measured on {scenario.dialect}: {', '.join(unknown)}")
+        results = {}
+        for name in names:
+            requests = EXPORT_REQUESTS if name.endswith("/export") else args.requests
+            results[name] = run_endpoint(app, headers, endpoints[name], args.concurrency, requests)
+            print(json.dumps({"endpoint": name, **results[name]}))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions, failures = compare(results, json.load(f)["results"], args.max_regression)
+        if regressions:
+            print(f"p95 regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+        if failures:
+            print(f"Answered errors, not compared: {', '.join(failures)}")
+        if regressions or failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
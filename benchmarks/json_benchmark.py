@@ -0,0 +1,73 @@
+"""Compares the JSON providers on list payloads shaped like GET /movies and GET /actors.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/json_benchmark.py [--per-page 100] [--actors 10]
+"""
+import argparse
+import timeit
+from datetime import date
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from json_provider.json_provider import FastJSONProvider, orjson
+
+
+def movies_payload(per_page, actors_per_movie):
+    movies = []
+    for i in range(per_page):
+        movies.append({
+            "id": i + 1,
+            "title": f"Movie number {i}",
+            "release_date": date(2020, 1, 1 + i % 28),
+            "actors": [
+                {"id": i * actors_per_movie + j + 1, "name": f"Actor {i}-{j}", "gender": "F",
+                 "age": 20 + j, "movie_id": i + 1}
+                for j in range(actors_per_movie)
+            ]
+        })
+    return {"success": True, "movies": movies}
+
+
+def actors_payload(per_page):
+    return {"success": True, "actors": [
+        {"id": i + 1, "name": f"Actor {i}", "gender": "M", "age": 20 + i % 50, "movie_id": i % 7 + 1}
+        for i in range(per_page)
+    ]}
+
+
+def providers(app):
+    yield "flask default", DefaultJSONProvider(app)
+    yield "fast (json)", FastJSONProvider(app, "json")
+    if orjson is not None:
+        yield "fast (orjson)", FastJSONProvider(app, "orjson")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--per-page", type=int, default=100)
+    parser.add_argument("--actors", type=int, default=10, help="Actors embedded per movie.")
+    parser.add_argument("--number", type=int, default=200, help="Responses encoded per timing.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    payloads = {
+        "movies": movies_payload(args.per_page, args.actors),
+        "actors": actors_payload(args.per_page),
+    }
+
+    with app.app_context():
+        for name, payload in payloads.items():
+            print(f"{name}: {args.per_page} items per page")
+            baseline = None
+            for label, provider in providers(app):
+                timings = timeit.repeat(lambda: provider.response(payload), number=args.number, repeat=args.repeat)
+                per_call = min(timings) / args.number * 1e6
+                size = len(provider.response(payload).get_data())
+                baseline = baseline or per_call
+                print(f"  {label:<14} {per_call:9.1f} us/response  {size:7d} bytes  x{baseline / per_call:.2f}")
+
+
+if __name__ == "__main__":
+    main()
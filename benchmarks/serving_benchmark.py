@@ -0,0 +1,115 @@
+"""Compares the sync (wsgi.py) and cooperative (async_wsgi.py) serving modes under concurrent load.
+
+Each mode is served by gunicorn with the same number of workers, on a database
+seeded by the benchmark, and hit by --concurrency clients with tokens signed
+by a local key. The database is DATABASE_URL, or a temporary SQLite file when
+it isn't set. The cooperative mode only pays off when requests wait on I/O,
+so compare them on PostgreSQL.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/serving_benchmark.py [--workers 2] [--concurrency 50] [--requests 2000]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+from benchmarks.support import latency_summary, make_local_jwks, mint_token, seed_database
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "sync": ["wsgi:application", "-k", "sync"],
+    "gevent": ["async_wsgi:application", "-k", "gevent", "--worker-connections", "1000"],
+}
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} didn't start in {timeout}s.")
+
+
+def fetch(url, headers):
+    started = time.perf_counter()
+    with urlopen(Request(url, headers=headers), timeout=30) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def run_load(url, headers, concurrency, requests):
+    fetch(url, headers)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(lambda _: fetch(url, headers), range(requests)))
+    return latency_summary(latencies, time.perf_counter() - started)
+
+
+def serve(mode, args, env):
+    with socket.socket() as sock:
+        if sock.connect_ex(("127.0.0.1", args.port)) == 0:
+            raise RuntimeError(f"Port {args.port} is already in use, pick another one with --port.")
+    command = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-b", f"127.0.0.1:{args.port}",
+               "--log-level", "warning", *MODES[mode]]
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="sync,gevent", help="Serving modes to compare, separated by commas.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--path", default="/movies?per_page=20")
+    parser.add_argument("--movies", type=int, default=200)
+    parser.add_argument("--actors", type=int, default=5, help="Actors per seeded movie.")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--output", help="File to write the JSON results to.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        private_key, jwks_url = make_local_jwks(tmpdir)
+        env = dict(os.environ)
+        env.setdefault("DATABASE_URL", f"sqlite:///{tmpdir}/benchmark.db")
+        env.setdefault("AUTH0_DOMAIN", "benchmark.local")
+        env.setdefault("API_AUDIENCE", "benchmark")
+        env["JWKS_URL"] = jwks_url
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+        os.environ.update(env)
+
+        from app import create_app
+        seed_database(create_app(), args.movies, args.movies * args.actors)
+        token = mint_token(private_key, env["AUTH0_DOMAIN"], env["API_AUDIENCE"])
+        headers = {"Authorization": f"Bearer {token}"}
+
+        results = {}
+        for mode in args.modes.split(","):
+            server = serve(mode, args, env)
+            try:
+                wait_until_ready(f"http://127.0.0.1:{args.port}/health")
+                results[mode] = run_load(f"http://127.0.0.1:{args.port}{args.path}", headers,
+                                         args.concurrency, args.requests)
+            finally:
+                server.terminate()
+                server.wait()
+            print(json.dumps({"mode": mode, **results[mode]}))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measures how long a worker takes to import the app and run create_app, for each DB_STARTUP mode.
+
+Every run is a fresh interpreter, like a new gunicorn worker without preload.
+The database is DATABASE_URL (already migrated with `alembic upgrade head`),
+or a temporary SQLite file prepared by the benchmark when it isn't set.
+Exits with status 1 when the median startup of check_revision exceeds --target-ms.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/startup_benchmark.py [--runs 10] [--target-ms 1000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+ready = time.perf_counter()
+json.dump({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (ready - imported) * 1000,
+    "total_ms": (ready - started) * 1000,
+    "modules": len(sys.modules),
+    "jwt_loaded": "jwt" in sys.modules,
+}, sys.stdout)
+"""
+
+
+def prepare_sqlite(env):
+    """Creates the tables and stamps the alembic head on a new SQLite database."""
+    command = ("from app import create_app; from database.models import SCHEMA_REVISION, db; "
+               "from sqlalchemy import text; app = create_app()\n"
+               "with app.app_context():\n"
+               "    db.session.execute(text('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)'))\n"
+               "    db.session.execute(text('INSERT INTO alembic_version VALUES (:revision)'), {'revision': SCHEMA_REVISION})\n"
+               "    db.session.commit()\n")
+    subprocess.run([sys.executable, "-c", command], cwd=ROOT, env={**env, "DB_STARTUP": "create_all"}, check=True)
+
+
+def measure(env, mode, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=ROOT, env={**env, "DB_STARTUP": mode},
+                                check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output))
+    summary = {"mode": mode, "runs": runs}
+    for key in ("import_ms", "create_app_ms", "total_ms"):
+        values = [sample[key] for sample in samples]
+        summary[key] = {"median": round(statistics.median(values), 1), "min": round(min(values), 1)}
+    summary["modules"] = samples[-1]["modules"]
+    summary["jwt_loaded"] = samples[-1]["jwt_loaded"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--modes", default="create_all,check_revision")
+    parser.add_argument("--target-ms", type=float, default=1000,
+                        help="Budget of the median total startup of check_revision.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+        if "DATABASE_URL" not in env:
+            env["DATABASE_URL"] = f"sqlite:///{tmpdir}/startup.db"
+            prepare_sqlite(env)
+
+        results = [measure(env, mode, args.runs) for mode in args.modes.split(",")]
+        for result in results:
+            print(json.dumps(result))
+
+    checked = [result for result in results if result["mode"] == "check_revision"]
+    if checked:
+        median = checked[0]["total_ms"]["median"]
+        within = median <= args.target_ms
+        print(f"check_revision startup: {median:.1f} ms, target {args.target_ms:.0f} ms: {'ok' if within else 'over budget'}")
+        if not within:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Helpers shared by the benchmarks: seeded databases, local signing keys, minted tokens and latency statistics."""
+import json
+import os
+import time
+from datetime import date
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+ALL_PERMISSIONS = [
+    "view:actors", "create:actors", "edit:actors", "delete:actors",
+    "view:movies", "create:movies", "edit:movies", "delete:movies",
+]
+
+
+def seed_database(app, movies, actors, batch_size=10000):
+    """Fills an empty database with movies and actors spread over them, inserted in batches.
+
+    Returns False, without inserting anything, when the database already has movies.
+    """
+    from database.models import Actor, Movie, db, record_changes
+
+    with app.app_context():
+        if db.session.query(Movie.id).first() is not None:
+            return False
+        for start in range(0, movies, batch_size):
+            db.session.execute(Movie.__table__.insert(), [
+                {"title": f"Movie {i}", "release_date": date(2020, 1, 1 + i % 28)}
+                for i in range(start, min(start + batch_size, movies))
+            ])
+        movie_ids = [movie_id for movie_id, in db.session.query(Movie.id).order_by(Movie.id)]
+        for start in range(0, actors, batch_size):
+            db.session.execute(Actor.__table__.insert(), [
+                {"name": f"Actor {i}", "gender": "FM"[i % 2], "age": 20 + i % 50,
+                 "movie_id": movie_ids[i % len(movie_ids)] if movie_ids else None}
+                for i in range(start, min(start + batch_size, actors))
+            ])
+            # Committed per batch, so millions of rows don't pile up in one transaction
+            db.session.commit()
+        record_changes(db.session, {"actors", "movies"})
+        db.session.commit()
+    return True
+
+
+def make_local_jwks(directory, kid="benchmark"):
+    """Writes the JWKS of a new RSA key to directory, returns the private key and the file:// URL of the JWKS."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    path = os.path.join(directory, "jwks.json")
+    with open(path, "w") as f:
+        json.dump({"keys": [jwk]}, f)
+    return private_key, f"file://{path}"
+
+
+def mint_token(private_key, domain, audience, permissions=ALL_PERMISSIONS, subject="auth0|benchmark", kid="benchmark"):
+    """Mints an RS256 token accepted by a server using the local JWKS."""
+    now = int(time.time())
+    payload = {"iss": f"https://{domain}/", "sub": subject, "iat": now, "exp": now + 3600, "permissions": permissions}
+    if audience:
+        payload["aud"] = audience
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def latency_summary(latencies, elapsed):
+    """Throughput and latency percentiles (milliseconds) of a run."""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
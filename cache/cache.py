@@ -0,0 +1,279 @@
+import os
+import sqlite3
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from hashlib import sha256
+from threading import Lock, local
+from time import time
+
+from dotenv import load_dotenv
+from flask import Response, current_app, g, request
+
+from database.models import change_listeners
+
+
+load_dotenv()
+
+
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "none")
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "/tmp/response_cache.db")
+
+
+CachedResponse = namedtuple('CachedResponse', ['status', 'mimetype', 'body'])
+
+'''
+Cache backends
+
+Every entry is stored with tags naming what it was built from: a table name
+for list responses, '<table>:<id>' for item responses.
+invalidate(tags) drops the entries carrying any of the given tags.
+
+The generation is a counter bumped by every invalidation. A response is only
+stored if the generation didn't move while it was being built, so a write that
+commits in the meantime can't leave a stale entry behind.
+'''
+
+
+class MemoryBackend:
+    """In-process LRU cache, one per worker."""
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, tags, value = entry
+            if expires_at <= time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._remove(key)
+            self._entries[key] = (time() + self.ttl, tags, value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[1]:
+                keys = self._tags.get(tag)
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Cache stored in a local SQLite file, shared by all the workers of a host."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = local()
+        with self._connection() as connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, status INTEGER, mimetype TEXT, body BLOB, expires_at REAL);
+                CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+                CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key));
+                CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER);
+                INSERT OR IGNORE INTO meta VALUES ('generation', 0);
+            ''')
+
+    def _connection(self):
+        # One connection per thread, reopened in forked workers
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def generation(self):
+        return self._connection().execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT status, mimetype, body FROM entries WHERE key = ? AND expires_at > ?", (key, time())
+        ).fetchone()
+        return CachedResponse(*row) if row else None
+
+    def set(self, key, value, tags, generation):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0] != generation:
+                return
+            connection.execute("DELETE FROM tags WHERE key = ?", (key,))
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value.status, value.mimetype, value.body, time() + self.ttl)
+            )
+            connection.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)", [(tag, key) for tag in tags])
+            self._evict(connection)
+        finally:
+            connection.execute("COMMIT")
+
+    def _evict(self, connection):
+        connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time(),))
+        connection.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,)
+        )
+        connection.execute("DELETE FROM tags WHERE key NOT IN (SELECT key FROM entries)")
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        placeholders = ",".join("?" * len(tags))
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+            connection.execute(f"DELETE FROM entries WHERE key IN (SELECT key FROM tags WHERE tag IN ({placeholders}))", tags)
+            connection.execute(f"DELETE FROM tags WHERE key IN (SELECT key FROM tags WHERE tag IN ({placeholders}))", tags)
+        finally:
+            connection.execute("COMMIT")
+
+    def clear(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+            connection.execute("DELETE FROM entries")
+            connection.execute("DELETE FROM tags")
+        finally:
+            connection.execute("COMMIT")
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM entries").fetchone()[0]
+
+
+def make_backend(name=RESPONSE_CACHE_BACKEND):
+    if name == "none":
+        return None
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {name}")
+
+
+'''
+ResponseCache
+    caches the 200 responses of GET endpoints, keyed by the database, the
+    endpoint, view arguments, query parameters, the permissions of the caller
+    and the versions of the tables read by @conditional; the database keeps
+    apps on different databases sharing a backend (e.g. the sqlite file) apart
+    entries are invalidated by the change listeners of the models once a
+    write commits, in this process only; the table versions in the key keep
+    the other processes (workers, the import command) from serving a
+    response older than the last write, whatever the backend
+'''
+class ResponseCache:
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        change_listeners.append(self.invalidate)
+
+    def invalidate(self, tags):
+        if self.backend is not None:
+            self.backend.invalidate(tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.backend) if self.backend is not None else 0
+        }
+
+    @staticmethod
+    def make_key(request, payload):
+        scope = " ".join(sorted(payload.get('permissions', ()))) if payload else ""
+        parts = [
+            str(current_app.config["SQLALCHEMY_DATABASE_URI"]),
+            request.endpoint,
+            repr(sorted(request.view_args.items())),
+            repr(sorted(request.args.items(multi=True))),
+            scope,
+            repr(sorted(g.get('table_versions', {}).items()))
+        ]
+        return sha256("|".join(parts).encode()).hexdigest()
+
+    def cached(self, *tags):
+        """Caches the responses of a GET endpoint decorated with requires_auth.
+
+        tags name what the response depends on and may use the view arguments,
+        e.g. @response_cache.cached('movies:{movie_id}').
+        """
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(payload, *args, **kwargs):
+                if self.backend is None:
+                    return f(payload, *args, **kwargs)
+
+                key = self.make_key(request, payload)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return Response(entry.body, status=entry.status, mimetype=entry.mimetype)
+
+                self.misses += 1
+                generation = self.backend.generation()
+                response = f(payload, *args, **kwargs)
+                if isinstance(response, Response) and response.status_code == 200 and not response.is_streamed:
+                    entry = CachedResponse(response.status_code, response.mimetype, response.get_data())
+                    self.backend.set(key, entry, {tag.format(**kwargs) for tag in tags}, generation)
+                return response
+
+            return wrapper
+        return cached_decorator
+
+
+response_cache = ResponseCache(make_backend())
@@ -0,0 +1,156 @@
+import os
+import zlib
+
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+load_dotenv()
+
+
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_LEVEL = int(os.environ.get("COMPRESSION_BROTLI_LEVEL", 4))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get("COMPRESSION_ZSTD_LEVEL", 3))
+# Preferred first when the client accepts several with the same quality
+COMPRESSION_ENCODINGS = os.environ.get("COMPRESSION_ENCODINGS", "br,zstd,gzip")
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html")
+
+'''
+Compressors
+    compress(data) returns the compressed bytes available so far
+    flush() returns everything written so far, so a streamed chunk can be
+    decoded by the client as soon as it is received
+    finish() ends the stream
+'''
+
+
+class GzipCompressor:
+    def __init__(self, level=COMPRESSION_GZIP_LEVEL):
+        # wbits 31 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, level=COMPRESSION_BROTLI_LEVEL):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level=COMPRESSION_ZSTD_LEVEL):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def available_compressors():
+    compressors = {"gzip": GzipCompressor}
+    if brotli is not None:
+        compressors["br"] = BrotliCompressor
+    if zstandard is not None:
+        compressors["zstd"] = ZstdCompressor
+    return compressors
+
+
+COMPRESSORS = available_compressors()
+
+
+def negotiate_encoding(request, encodings=COMPRESSION_ENCODINGS):
+    """Picks the content coding of a response from the Accept-Encoding of the request, or None."""
+    best, best_quality = None, 0
+    for encoding in encodings.split(","):
+        encoding = encoding.strip()
+        if encoding not in COMPRESSORS:
+            continue
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_stream(chunks, compressor):
+    """Compresses the chunks of a streamed body one by one, flushing after each."""
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+'''
+compress_response(request, response)
+    compresses the body of a response with the best encoding accepted by
+    the client, from the after_request hook of the app
+    only text responses are compressed: buffered ones once they reach
+    COMPRESSION_MIN_SIZE bytes, streamed ones (exports) always, chunk by chunk
+    a strong ETag becomes weak, as the compressed body isn't byte-for-byte
+    the one it was computed for
+'''
+def compress_response(request, response, min_size=COMPRESSION_MIN_SIZE):
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, COMPRESSORS[encoding]())
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        compressor = COMPRESSORS[encoding]()
+        response.set_data(compressor.compress(data) + compressor.finish())
+
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,92 @@
+import csv
+import io
+import json
+import os
+from datetime import date
+
+from sqlalchemy import select
+
+from database.models import Actor, Movie, db
+
+
+'''
+Streaming export of actors and movies
+
+Rows are read through a server-side cursor (stream_results) in chunks of
+EXPORT_CHUNK_SIZE and written out as NDJSON lines or CSV rows, so the memory of
+the worker stays flat whatever the size of the tables.
+Movies embed their actors, loaded with one IN query per chunk of movies.
+'''
+
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 1000))
+
+ACTOR_COLUMNS = ("id", "name", "gender", "age", "movie_id")
+MOVIE_COLUMNS = ("id", "title", "release_date")
+
+
+def to_json(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def ndjson_line(item):
+    return json.dumps(item, default=to_json, separators=(",", ":")) + "\n"
+
+
+def csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def stream_chunks(connection, statement, chunk_size):
+    """Yields lists of row mappings read through a server-side cursor."""
+    result = connection.execution_options(stream_results=True).execute(statement)
+    for rows in result.partitions(chunk_size):
+        yield [row._mapping for row in rows]
+
+
+def export_actors(fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields the actors table as NDJSON or CSV text chunks."""
+    columns = [getattr(Actor, column) for column in ACTOR_COLUMNS]
+    if fmt == "csv":
+        yield csv_line(ACTOR_COLUMNS)
+
+    with db.engine.connect() as connection:
+        for rows in stream_chunks(connection, select(*columns).order_by(Actor.id), chunk_size):
+            if fmt == "csv":
+                yield "".join(csv_line([row[column] for column in ACTOR_COLUMNS]) for row in rows)
+            else:
+                yield "".join(ndjson_line(dict(row)) for row in rows)
+
+
+def actors_by_movie(connection, movie_ids):
+    """Loads the actors of the given movies with one IN query, grouped by movie id."""
+    columns = [getattr(Actor, column) for column in ACTOR_COLUMNS]
+    statement = select(*columns).where(Actor.movie_id.in_(movie_ids)).order_by(Actor.id)
+    actors = {movie_id: [] for movie_id in movie_ids}
+    for row in connection.execute(statement):
+        actors[row.movie_id].append(dict(row._mapping))
+    return actors
+
+
+def export_movies(fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields the movies table with nested actors as NDJSON or CSV text chunks.
+
+    CSV rows hold the ids of the actors of each movie, separated by semicolons.
+    """
+    columns = [getattr(Movie, column) for column in MOVIE_COLUMNS]
+    if fmt == "csv":
+        yield csv_line(MOVIE_COLUMNS + ("actor_ids",))
+
+    with db.engine.connect() as connection:
+        for rows in stream_chunks(connection, select(*columns).order_by(Movie.id), chunk_size):
+            actors = actors_by_movie(connection, [row["id"] for row in rows])
+            if fmt == "csv":
+                yield "".join(csv_line(
+                    [row[column] for column in MOVIE_COLUMNS]
+                    + [";".join(str(actor["id"]) for actor in actors[row["id"]])]
+                ) for row in rows)
+            else:
+                yield "".join(ndjson_line(dict(row, actors=actors[row["id"]])) for row in rows)
@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+from datetime import date
+from itertools import islice
+from time import monotonic
+
+import click
+from flask.cli import with_appcontext
+
+from database.models import Actor, Movie, db, record_changes
+
+
+'''
+Streaming import of actors and movies
+
+Rows are read one at a time from NDJSON or CSV, so memory stays bounded by the batch size.
+
+movies rows: external_id, title, release_date (YYYY-MM-DD)
+actors rows: external_id, name, age, gender, and either movie_external_id
+    (resolved against Movie.external_id) or movie_id
+
+Rows whose external_id already exists are skipped, so replaying a batch after a
+crash never duplicates it. The checkpoint file records how many input rows were
+committed, and a rerun with the same checkpoint resumes after them.
+The checkpoint is saved after the commit of its batch: a crash in between
+replays that batch, which inserts its rows without external_id a second time.
+'''
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    """Yields the rows of an NDJSON or CSV stream as dicts."""
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield {key: value if value != "" else None for key, value in row.items()}
+        return
+
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            raise click.ClickException(f"Line {number} is not valid JSON.")
+
+
+def to_int(value, field):
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ImportRowError(f"{field} must be an integer.")
+
+
+def to_text(value, field):
+    if value is not None and not isinstance(value, str):
+        raise ImportRowError(f"{field} must be a string.")
+    return value
+
+
+def to_key(value):
+    return None if value is None else str(value)
+
+
+def movie_values(row):
+    title = to_text(row.get("title"), "title")
+    release_date = row.get("release_date")
+    if not title or not release_date:
+        raise ImportRowError("Title and release date are required.")
+    try:
+        release_date = date.fromisoformat(release_date)
+    except (TypeError, ValueError):
+        raise ImportRowError("Release date must be an ISO date (YYYY-MM-DD).")
+    return {"external_id": to_key(row.get("external_id")), "title": title, "release_date": release_date}
+
+
+def actor_values(row):
+    name = to_text(row.get("name"), "name")
+    age = to_int(row.get("age"), "age")
+    if not name or not age:
+        raise ImportRowError("Name and age are required.")
+    return {
+        "external_id": to_key(row.get("external_id")),
+        "name": name,
+        "age": age,
+        "gender": to_text(row.get("gender"), "gender") or "Other",
+        "movie_id": to_int(row.get("movie_id"), "movie_id"),
+        "movie_external_id": to_key(row.get("movie_external_id")),
+    }
+
+
+def existing_external_ids(model, external_ids):
+    if not external_ids:
+        return set()
+    query = db.session.query(model.external_id).filter(model.external_id.in_(external_ids))
+    return {row.external_id for row in query}
+
+
+def resolve_movie_ids(values):
+    """Replaces movie_external_id with the matching movie id and checks plain movie ids,
+    with one IN query each per batch.
+
+    Yields (row number, values, None) or (row number, None, error message).
+    """
+    keys = {value["movie_external_id"] for _, value in values if value["movie_external_id"]}
+    movie_ids = {}
+    if keys:
+        query = db.session.query(Movie.external_id, Movie.id).filter(Movie.external_id.in_(keys))
+        movie_ids = dict(query.all())
+
+    ids = {value["movie_id"] for _, value in values if value["movie_id"] is not None}
+    existing_ids = set()
+    if ids:
+        existing_ids = {row.id for row in db.session.query(Movie.id).filter(Movie.id.in_(ids))}
+
+    for number, value in values:
+        key = value.pop("movie_external_id")
+        if key:
+            if key not in movie_ids:
+                yield number, None, f"Movie with external id {key} not found."
+                continue
+            value["movie_id"] = movie_ids[key]
+        elif value["movie_id"] is not None and value["movie_id"] not in existing_ids:
+            yield number, None, f"Movie with id {value['movie_id']} not found."
+            continue
+        yield number, value, None
+
+
+def insert_batch(model, batch):
+    """Validates and inserts one batch of (row number, row) pairs, returns (inserted, errors)."""
+    build = movie_values if model is Movie else actor_values
+    values, errors = [], []
+    for number, row in batch:
+        if not isinstance(row, dict):
+            errors.append((number, "Row must be an object."))
+            continue
+        try:
+            values.append((number, build(row)))
+        except ImportRowError as e:
+            errors.append((number, str(e)))
+
+    if model is Actor:
+        checked = []
+        for number, value, error in resolve_movie_ids(values):
+            if error:
+                errors.append((number, error))
+            else:
+                checked.append((number, value))
+        values = checked
+
+    # Skips rows committed by an interrupted run and repeated keys within the batch
+    seen = existing_external_ids(model, [value["external_id"] for _, value in values if value["external_id"]])
+    rows = []
+    for _, value in values:
+        if value["external_id"] is not None:
+            if value["external_id"] in seen:
+                continue
+            seen.add(value["external_id"])
+        rows.append(value)
+    if rows:
+        db.session.execute(model.__table__.insert(), rows)
+        tags = {model.__tablename__} | {f"movies:{row['movie_id']}" for row in rows if row.get("movie_id")}
+        record_changes(db.session, tags)
+    db.session.commit()
+    return len(rows), errors
+
+
+def rate(rows, elapsed):
+    return rows / max(elapsed, 1e-9)
+
+
+class Checkpoint:
+    """Number of committed input rows, persisted in a small JSON file."""
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("kind") != self.kind:
+            raise click.ClickException(f"Checkpoint {self.path} belongs to an import of {state.get('kind')}.")
+        return state["rows"]
+
+    def save(self, rows):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"kind": self.kind, "rows": rows}, f)
+        os.replace(tmp_path, self.path)
+
+
+@click.command("import")
+@click.argument("kind", type=click.Choice(["movies", "actors"]))
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]),
+              help="Input format, guessed from the file extension by default (ndjson).")
+@click.option("--batch-size", type=click.IntRange(min=1), default=1000, show_default=True,
+              help="Rows committed per transaction.")
+@click.option("--checkpoint", type=click.Path(dir_okay=False),
+              help="File recording the committed rows, used to resume an interrupted import.")
+@with_appcontext
+def import_command(kind, source, fmt, batch_size, checkpoint):
+    """Import movies or actors from an NDJSON or CSV file (or - for stdin)."""
+    if fmt is None:
+        fmt = "csv" if source.name.endswith(".csv") else "ndjson"
+    model = Movie if kind == "movies" else Actor
+    checkpoint = Checkpoint(checkpoint, kind)
+
+    done = checkpoint.load()
+    rows = enumerate(read_rows(source, fmt), start=1)
+    if done:
+        click.echo(f"Resuming after row {done}.")
+        rows = islice(rows, done, None)
+
+    imported = failed = 0
+    started = monotonic()
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        inserted, errors = insert_batch(model, batch)
+        imported += inserted
+        failed += len(errors)
+        for number, error in sorted(errors):
+            click.echo(f"Row {number} skipped: {error}", err=True)
+
+        done = batch[-1][0]
+        checkpoint.save(done)
+        click.echo(f"{done} rows read, {imported} {kind} imported ({rate(imported, monotonic() - started):.0f} rows/s)")
+
+    elapsed = monotonic() - started
+    click.echo(f"Imported {imported} {kind} in {elapsed:.1f}s ({rate(imported, elapsed):.0f} rows/s), {failed} rows skipped.")
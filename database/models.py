@@ -1,10 +1,18 @@
 from datetime import date
+from functools import lru_cache
+from operator import attrgetter
 import os
 from dotenv import load_dotenv
-from sqlalchemy import ForeignKey, Column, String, Integer, Date
-from sqlalchemy.orm import relationship
+from sqlalchemy import ForeignKey, Column, String, Integer, Date, event
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, relationship
 from flask_sqlalchemy import SQLAlchemy
 
+from database.pool import engine_options, watch_engine
+from database.routing import DATABASE_REPLICA_URLS, RoutingSession, mark_replica_down, replica_key, replica_set
+from database import slow_queries  # hands the timed statements to the slow query log
+
 
 load_dotenv()
 
@@ -12,19 +20,76 @@ database_path = os.environ['DATABASE_URL']
 if database_path.startswith("postgres://"):
   database_path = database_path.replace("postgres://", "postgresql://", 1)
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# create_all creates the missing tables at startup (development and tests),
+# check_revision only checks that the database was migrated to SCHEMA_REVISION
+DB_STARTUP = os.environ.get("DB_STARTUP", "create_all")
+# The alembic head revision, bumped with every migration (test_app.py checks it)
+SCHEMA_REVISION = '9b4f7e21c3a8'
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the pool is configured from the DB_POOL_* settings of database/pool.py,
+    which SQLALCHEMY_ENGINE_OPTIONS in the app config can override
+    replica_urls are read replicas serving the GET requests (see database/routing.py)
+    startup is create_all or check_revision, see DB_STARTUP
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_urls=DATABASE_REPLICA_URLS, startup=DB_STARTUP):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+      **engine_options(database_path),
+      **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    }
+    replicas = {replica_key(i): {"url": url, **engine_options(url)} for i, url in enumerate(replica_urls)}
+    app.config["SQLALCHEMY_BINDS"] = {**app.config.get("SQLALCHEMY_BINDS", {}), **replicas}
+    replica_set.configure(replicas)
     db.app = app
     db.init_app(app)
     with app.app_context():
-      db.create_all()
+      for engine in db.engines.values():
+        watch_engine(engine)
+      for key in replicas:
+        event.listen(db.engines[key], 'handle_error', mark_replica_down(key))
+      if startup == "check_revision":
+        check_schema_revision(db.engine)
+      elif startup == "create_all":
+        # Only the primary, the replicas get their schema through replication
+        db.create_all(bind_key=None)
+        seed_table_versions()
+      else:
+        raise ValueError(f"Unknown DB_STARTUP: {startup}")
+
+
+class SchemaRevisionError(RuntimeError):
+  pass
+
+
+'''
+check_schema_revision(engine)
+    checks that the database was migrated to SCHEMA_REVISION with one query
+    on alembic_version, instead of inspecting every table like create_all
+    the result is kept per database, so the workers forked from a preloaded
+    master and the later apps of a process skip the query
+'''
+checked_databases = set()
+
+def check_schema_revision(engine):
+  key = str(engine.url)
+  if key in checked_databases:
+    return
+  try:
+    with engine.connect() as connection:
+      revision = connection.execute(text("SELECT version_num FROM alembic_version")).scalar()
+  except SQLAlchemyError:
+    revision = None
+  if revision != SCHEMA_REVISION:
+    raise SchemaRevisionError(
+      f"The database is at revision {revision}, expected {SCHEMA_REVISION}. Run `alembic upgrade head`."
+    )
+  checked_databases.add(key)
 
 
 '''
@@ -36,9 +101,145 @@ db_drop_and_create_all()
 
 
 def db_drop_and_create_all():
-    db.drop_all()
-    db.create_all()
-    
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+    seed_table_versions()
+
+#----------------------------------------------------------------------------#
+# Table Versions
+#----------------------------------------------------------------------------#
+
+'''
+TableVersion
+    a counter per table, bumped in the same transaction as every write to it
+    GET endpoints derive their ETags from it, so an unchanged table can be
+    answered with 304 without querying its rows
+'''
+VERSIONED_TABLES = ('actors', 'movies')
+
+class TableVersion(db.Model):
+  __tablename__ = 'table_versions'
+
+  name = Column(String, primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+
+
+def seed_table_versions():
+  existing = {row.name for row in db.session.query(TableVersion.name)}
+  for name in VERSIONED_TABLES:
+    if name not in existing:
+      db.session.add(TableVersion(name=name, version=0))
+  db.session.commit()
+
+
+def get_table_versions(tables):
+  rows = db.session.query(TableVersion.name, TableVersion.version).filter(TableVersion.name.in_(tables))
+  versions = dict.fromkeys(tables, 0)
+  versions.update(rows)
+  return versions
+
+
+def bump_table_versions(connection, tables):
+  tables = sorted(set(tables) & set(VERSIONED_TABLES))
+  if tables:
+    connection.execute(
+      TableVersion.__table__.update()
+      .where(TableVersion.name.in_(tables))
+      .values(version=TableVersion.version + 1)
+    )
+
+#----------------------------------------------------------------------------#
+# Change Tracking
+#----------------------------------------------------------------------------#
+
+'''
+record_changes(session, tags)
+    records what the current transaction of the session changed
+    a tag is either a table name or '<table>:<id>' for one row
+    the versions of the changed tables are bumped in the same transaction
+    and every listener of change_listeners is called with the tags once the
+    transaction commits (e.g. to invalidate cached responses)
+    ORM writes (insert/update/delete) are recorded by the after_flush listener
+    below, writes that bypass the ORM (Core inserts and updates) must call it themselves
+'''
+change_listeners = []
+
+def record_changes(session, tags):
+  tags = set(tags)
+  if tags:
+    # The rest of the request reads from the primary to see these writes
+    session.info['wrote'] = True
+    bump_table_versions(session.connection(), {tag.split(':')[0] for tag in tags})
+    session.info.setdefault('changed_tags', set()).update(tags)
+
+
+def changed_tags(obj):
+  # Movies embed their actors, so an actor also changes the movies it joins or leaves
+  if isinstance(obj, Actor):
+    history = inspect(obj).attrs.movie_id.history
+    movie_ids = set(history.added) | set(history.deleted) | set(history.unchanged)
+    return {'actors', f'actors:{obj.id}'} | {f'movies:{movie_id}' for movie_id in movie_ids if movie_id is not None}
+  if isinstance(obj, Movie):
+    return {'movies', f'movies:{obj.id}'}
+  return set()
+
+
+'''
+update_row(model, row_id, values)
+    updates the row of model with the given id without loading it first and
+    returns the updated row, or None when no row has that id
+    one UPDATE ... RETURNING where the dialect supports it, the UPDATE then
+    a SELECT of the row otherwise
+    the change is recorded like the ORM writes, the caller commits
+'''
+def update_row(model, row_id, values):
+  table = model.__table__
+  statement = table.update().where(table.c.id == row_id).values(**values)
+  dialect = db.session.get_bind(clause=statement).dialect
+  if values and supports_update_returning(dialect):
+    row = db.session.execute(statement.returning(*table.c)).first()
+  else:
+    if values:
+      db.session.execute(statement)
+    row = db.session.execute(select(table).where(table.c.id == row_id)).first()
+  if row is not None and values:
+    record_changes(db.session, updated_tags(model, row))
+  return row
+
+
+def supports_update_returning(dialect):
+  # update_returning since SQLAlchemy 2.0, full_returning before
+  return getattr(dialect, 'update_returning', getattr(dialect, 'full_returning', False))
+
+
+def updated_tags(model, row):
+  # Like changed_tags, for a row updated without the ORM
+  tags = {model.__tablename__, f'{model.__tablename__}:{row.id}'}
+  if model is Actor and row.movie_id is not None:
+    tags.add(f'movies:{row.movie_id}')
+  return tags
+
+
+@event.listens_for(Session, 'after_flush')
+def record_flushed_changes(session, flush_context):
+  tags = set()
+  for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+    tags |= changed_tags(obj)
+  record_changes(session, tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def notify_change_listeners(session):
+  tags = session.info.pop('changed_tags', None)
+  if tags:
+    for listener in change_listeners:
+      listener(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+  session.info.pop('changed_tags', None)
+
 #----------------------------------------------------------------------------#
 # Actors Model 
 #----------------------------------------------------------------------------#
@@ -47,16 +248,18 @@ class Actor(db.Model):
   __tablename__ = 'actors'
 
   id = Column(Integer, primary_key=True)
-  name = Column(String)
+  name = Column(String, index=True)
   gender = Column(String)
-  age = Column(Integer)
-  movie_id = Column(Integer, ForeignKey('movies.id'), nullable=True)
+  age = Column(Integer, index=True)
+  movie_id = Column(Integer, ForeignKey('movies.id'), index=True, nullable=True)
+  external_id = Column(String, index=True, unique=True, nullable=True)
 
-  def __init__(self, name, gender, age, movie_id):
+  def __init__(self, name, gender, age, movie_id, external_id=None):
     self.name = name
     self.gender = gender
     self.age = age
     self.movie_id = movie_id
+    self.external_id = external_id
 
   def insert(self):
     db.session.add(self)
@@ -69,14 +272,11 @@ class Actor(db.Model):
     db.session.delete(self)
     db.session.commit()
 
+  FIELDS = ('id', 'name', 'gender', 'age', 'movie_id')
+  RELATIONS = {}
+
   def format(self):
-    return {
-      'id': self.id,
-      'name' : self.name,
-      'gender': self.gender,
-      'age': self.age,
-      "movie_id": self.movie_id
-    }
+    return serializer(Actor)(self)
 
 #----------------------------------------------------------------------------#
 # Movies Model 
@@ -86,13 +286,15 @@ class Movie(db.Model):
   __tablename__ = 'movies'
 
   id = Column(Integer, primary_key=True)
-  title = Column(String)
-  release_date = Column(Date)
+  title = Column(String, index=True)
+  release_date = Column(Date, index=True)
+  external_id = Column(String, index=True, unique=True, nullable=True)
   actors = relationship('Actor', backref="movie", lazy=True)
 
-  def __init__(self, title, release_date) :
+  def __init__(self, title, release_date, external_id=None) :
     self.title = title
     self.release_date = release_date
+    self.external_id = external_id
 
   def insert(self):
     db.session.add(self)
@@ -105,10 +307,37 @@ class Movie(db.Model):
     db.session.delete(self)
     db.session.commit()
 
+  FIELDS = ('id', 'title', 'release_date')
+  RELATIONS = {'actors': Actor}
+
   def format(self):
-    return {
-      'id': self.id,
-      'title' : self.title,
-      'release_date': self.release_date,
-      'actors': list(map(lambda actor: actor.format(), self.actors))
-    }
+    return serializer(Movie, include=('actors',))(self)
+
+#----------------------------------------------------------------------------#
+# Serializers
+#----------------------------------------------------------------------------#
+
+'''
+serializer(model, fields=None, include=())
+    returns a function turning an instance of model into a dict of the given
+    fields (all of model.FIELDS by default) plus the full serialization of
+    each included relation
+    the extractors are built once per combination, so serializing a row is
+    one attrgetter call and a zip, without per-instance lookups of what to build
+'''
+@lru_cache(maxsize=256)
+def serializer(model, fields=None, include=()):
+  fields = model.FIELDS if fields is None else tuple(fields)
+  get_values = attrgetter(*fields)
+  if len(fields) == 1:
+    get_single = get_values
+    get_values = lambda obj: (get_single(obj),)
+  nested = [(name, attrgetter(name), serializer(model.RELATIONS[name])) for name in include]
+
+  def serialize(obj):
+    item = dict(zip(fields, get_values(obj)))
+    for name, get_related, serialize_related in nested:
+      item[name] = [serialize_related(related) for related in get_related(obj)]
+    return item
+
+  return serialize
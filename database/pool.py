@@ -0,0 +1,154 @@
+import os
+from threading import Lock
+from time import monotonic
+from weakref import WeakSet
+
+from dotenv import load_dotenv
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+load_dotenv()
+
+
+'''
+Connection pool settings
+    read from the environment and applied to every database but SQLite,
+    whose connections are local files that Flask-SQLAlchemy already pools
+    DB_STATEMENT_TIMEOUT is in milliseconds, 0 disables it
+'''
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))
+
+
+class PoolStats:
+    """Counters of the connection pools of this process."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.timeouts = 0
+            self.waits = 0
+            self.wait_time = 0.0
+            self.max_wait_time = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += seconds
+            self.max_wait_time = max(self.max_wait_time, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool):
+        """Returns the counters together with the live state of pool."""
+        with self._lock:
+            stats = {
+                "pool": type(pool).__name__,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checked_out": self.checkouts - self.checkins,
+                "timeouts": self.timeouts,
+                "wait_time": round(self.wait_time, 6),
+                "max_wait_time": round(self.max_wait_time, 6),
+                "avg_wait_time": round(self.wait_time / self.waits, 6) if self.waits else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+            })
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = monotonic()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_wait(monotonic() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(monotonic() - started)
+        return connection
+
+
+def engine_options(database_url):
+    """SQLAlchemy engine options of the pool settings, none for SQLite."""
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        return {}
+
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT and url.get_backend_name() == "postgresql":
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"}
+    return options
+
+
+'''
+watch_engine(engine)
+    counts the connections, checkouts and checkins of the pool of engine
+    and disposes of the pool in forked children: a gunicorn worker must not
+    reuse the sockets opened by the master before the fork, so it drops them
+    without closing them (the parent still owns them) and opens its own
+'''
+engines = WeakSet()
+
+def watch_engine(engine):
+    if engine in engines:
+        return
+    engines.add(engine)
+    event.listen(engine, "connect", lambda *args: pool_stats.count("connects"))
+    event.listen(engine, "checkout", lambda *args: pool_stats.count("checkouts"))
+    event.listen(engine, "checkin", lambda *args: pool_stats.count("checkins"))
+
+
+def warm_pool(engine, connections=DB_POOL_SIZE):
+    """Opens up to connections connections at once and returns them to the pool, ready for the first requests."""
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
+
+
+def dispose_engines_after_fork():
+    for engine in list(engines):
+        engine.dispose(close=False)
+    pool_stats.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=dispose_engines_after_fork)
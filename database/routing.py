@@ -0,0 +1,99 @@
+import os
+from itertools import count
+from threading import Lock
+from time import monotonic
+
+from dotenv import load_dotenv
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+
+
+load_dotenv()
+
+
+'''
+Read replicas
+    DATABASE_REPLICA_URLS lists the replicas, separated by commas
+    the replicas are SQLALCHEMY_BINDS of the app named replica_0, replica_1...
+    a replica that fails to connect is skipped for DB_REPLICA_RETRY_INTERVAL
+    seconds, and reads go to the primary when no replica is available
+'''
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_RETRY_INTERVAL = float(os.environ.get("DB_REPLICA_RETRY_INTERVAL", 30))
+
+READ_ONLY_METHODS = ("GET", "HEAD")
+
+
+def replica_key(index):
+    return f"replica_{index}"
+
+
+class ReplicaSet:
+    """Round robin over the replicas that aren't marked down."""
+
+    def __init__(self, retry_interval=DB_REPLICA_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self.keys = []
+        self._down_until = {}
+        self._next = count()
+        self._lock = Lock()
+
+    def configure(self, keys):
+        with self._lock:
+            self.keys = list(keys)
+            self._down_until.clear()
+
+    def choose(self):
+        """Returns the bind key of the next healthy replica, or None."""
+        with self._lock:
+            now = monotonic()
+            for _ in range(len(self.keys)):
+                key = self.keys[next(self._next) % len(self.keys)]
+                if self._down_until.get(key, 0) <= now:
+                    return key
+        return None
+
+    def mark_down(self, key):
+        with self._lock:
+            self._down_until[key] = monotonic() + self.retry_interval
+
+    def status(self):
+        now = monotonic()
+        return {key: "down" if self._down_until.get(key, 0) > now else "up" for key in self.keys}
+
+
+replica_set = ReplicaSet()
+
+
+'''
+RoutingSession
+    the session class of db, sending the reads of GET and HEAD requests to a
+    replica and everything else to the primary
+    a request sticks to one replica, and once its session writes anything it
+    reads from the primary for the rest of the request, so it sees its own
+    writes
+'''
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.reads_from_replica(clause):
+            key = self.info.get("replica")
+            if key is None:
+                key = self.info["replica"] = replica_set.choose()
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def reads_from_replica(self, clause):
+        if not replica_set.keys or self._flushing or self.info.get("wrote"):
+            return False
+        if getattr(clause, "is_dml", False):
+            return False
+        return has_request_context() and request.method in READ_ONLY_METHODS
+
+
+def mark_replica_down(key):
+    """Returns a handle_error listener marking the replica down when it can't be reached."""
+    def handle_error(context):
+        if context.is_disconnect or context.connection is None:
+            replica_set.mark_down(key)
+    return handle_error
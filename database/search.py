@@ -0,0 +1,94 @@
+from sqlalchemy import DDL, case, column, event, func, select, table, text
+
+from database.models import Actor, Movie, db
+
+
+'''
+Name and title search
+
+Matches are case-insensitive substrings of Actor.name and Movie.title, ranked
+with prefix matches first, then by closeness, then by id.
+
+The matching is backed by a trigram index on each searched column:
+    PostgreSQL: GIN indexes with pg_trgm on lower(name) and lower(title)
+    SQLite: FTS5 tables with the trigram tokenizer, kept current by triggers
+        so every writer (ORM, Core inserts, other workers) updates them
+Other databases, SQLite builds without FTS5 or older than 3.34 (the first with
+the trigram tokenizer), and SQLite files created before the FTS5 tables, fall
+back to a LIKE scan of the base table.
+'''
+
+SEARCHED_COLUMNS = {'actors': 'name', 'movies': 'title'}
+TRIGRAM_SQLITE_VERSION = (3, 34, 0)
+
+
+def sqlite_has_trigram(ddl, target, bind, **kw):
+    """Whether the SQLite library of bind has FTS5 with the trigram tokenizer."""
+    if bind.dialect.dbapi.sqlite_version_info < TRIGRAM_SQLITE_VERSION:
+        return False
+    return bool(bind.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def trigram_ddl(table_name, column_name):
+    """DDL statements creating the trigram index of a searched column on PostgreSQL and SQLite."""
+    fts = f'{table_name}_fts'
+    return [
+        DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+        DDL(f'CREATE INDEX IF NOT EXISTS ix_{table_name}_{column_name}_trgm '
+            f'ON {table_name} USING gin (lower({column_name}) gin_trgm_ops)').execute_if(dialect='postgresql'),
+        DDL(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{column_name}, content='{table_name}', content_rowid='id', tokenize='trigram')").execute_if(dialect='sqlite', callable_=sqlite_has_trigram),
+        DDL(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table_name} BEGIN "
+            f"INSERT INTO {fts}(rowid, {column_name}) VALUES (new.id, new.{column_name}); "
+            f"END").execute_if(dialect='sqlite', callable_=sqlite_has_trigram),
+        DDL(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table_name} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column_name}) VALUES ('delete', old.id, old.{column_name}); "
+            f"END").execute_if(dialect='sqlite', callable_=sqlite_has_trigram),
+        DDL(f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column_name} ON {table_name} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column_name}) VALUES ('delete', old.id, old.{column_name}); "
+            f"INSERT INTO {fts}(rowid, {column_name}) VALUES (new.id, new.{column_name}); "
+            f"END").execute_if(dialect='sqlite', callable_=sqlite_has_trigram),
+    ]
+
+
+for searched_model in (Actor, Movie):
+    for statement in trigram_ddl(searched_model.__tablename__, SEARCHED_COLUMNS[searched_model.__tablename__]):
+        event.listen(searched_model.__table__, 'after_create', statement)
+
+
+fts_tables = {}
+
+def has_fts_table(session, table_name):
+    key = (str(session.get_bind().url), table_name)
+    if key not in fts_tables:
+        query = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name")
+        fts_tables[key] = session.execute(query, {'name': f'{table_name}_fts'}).first() is not None
+    return fts_tables[key]
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search(model, q, limit, offset, *options):
+    """Returns a page of the rows of model whose searched column contains q, best matches first."""
+    session = db.session
+    column_name = SEARCHED_COLUMNS[model.__tablename__]
+    searched = getattr(model, column_name)
+    dialect = session.get_bind().dialect.name
+    q = q.lower()
+
+    prefix = case((func.lower(searched).like(escape_like(q) + '%', escape='\\'), 0), else_=1)
+    query = model.query.options(*options)
+
+    if dialect == 'sqlite' and not any(c in q for c in '%_') and has_fts_table(session, model.__tablename__):
+        # FTS5 only uses its trigram index for LIKE patterns without an ESCAPE clause
+        fts = table(f'{model.__tablename__}_fts', column('rowid'), column(column_name))
+        matches = select(fts.c.rowid).where(fts.c[column_name].like(f'%{q}%'))
+        query = query.filter(model.id.in_(matches))
+        closeness = func.length(searched)
+    else:
+        query = query.filter(func.lower(searched).like(f'%{escape_like(q)}%', escape='\\'))
+        closeness = -func.similarity(func.lower(searched), q) if dialect == 'postgresql' else func.length(searched)
+
+    return query.order_by(prefix, closeness, model.id).limit(limit).offset(offset).all()
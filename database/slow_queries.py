@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import random
+from datetime import date, datetime, timezone
+
+from dotenv import load_dotenv
+from flask import has_request_context, request
+
+from metrics.metrics import statement_listeners
+
+
+load_dotenv()
+
+
+'''
+Slow query log
+    statements running longer than SLOW_QUERY_THRESHOLD_MS are written as
+    JSON lines to SLOW_QUERY_LOG (no log when empty), with the route of the
+    request that ran them, their duration and their parameters, strings
+    redacted
+    SLOW_QUERY_SAMPLE_RATE is the fraction of the slow statements logged,
+    since each one logged costs an EXPLAIN
+    SLOW_QUERY_EXPLAIN is plan (EXPLAIN), analyze (EXPLAIN ANALYZE, which runs
+    the statement again, PostgreSQL only) or off
+    only SELECT statements are explained, on the same connection and with the
+    same parameters, so the plan is the one the statement got
+'''
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "")
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 200))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get("SLOW_QUERY_SAMPLE_RATE", 1.0))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "plan")
+
+EXPLAIN_MODES = ("off", "plan", "analyze")
+
+
+def redact(value):
+    """Keeps the values useful to reproduce a plan (numbers, dates), hides the text."""
+    if isinstance(value, (str, bytes)):
+        return f"<redacted {type(value).__name__}({len(value)})>"
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def explain_prefix(dialect, analyze):
+    if dialect == "postgresql":
+        return "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " if analyze else "EXPLAIN (FORMAT JSON) "
+    if dialect == "sqlite":
+        return "EXPLAIN QUERY PLAN "
+    return "EXPLAIN "
+
+
+class SlowQueryLog:
+    def __init__(self, path=SLOW_QUERY_LOG, threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+                 sample_rate=SLOW_QUERY_SAMPLE_RATE, explain=SLOW_QUERY_EXPLAIN):
+        self.logger = logging.getLogger("capstone.slow_queries")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.configure(path, threshold_ms, sample_rate, explain)
+
+    def configure(self, path=SLOW_QUERY_LOG, threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+                  sample_rate=SLOW_QUERY_SAMPLE_RATE, explain=SLOW_QUERY_EXPLAIN):
+        if explain not in EXPLAIN_MODES:
+            raise ValueError(f"Unknown SLOW_QUERY_EXPLAIN: {explain}")
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.explain = explain
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        if path:
+            # Lines are appended, so the workers of a host can share the file
+            handler = logging.FileHandler(path, delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def should_log(self, elapsed):
+        return self.enabled and elapsed >= self.threshold and random.random() < self.sample_rate
+
+    def record(self, conn, statement, parameters, executemany, elapsed):
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "pid": os.getpid(),
+            "method": None,
+            "route": None,
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            "parameters": redact(parameters),
+            "executemany": executemany,
+        }
+        if has_request_context():
+            entry["method"] = request.method
+            entry["route"] = request.url_rule.rule if request.url_rule is not None else request.path
+        if self.explain != "off" and not executemany and statement.lstrip()[:6].upper() == "SELECT":
+            try:
+                entry["plan"] = self.explain_statement(conn, statement, parameters)
+            except Exception as e:
+                entry["explain_error"] = str(e)
+        self.logger.info(json.dumps(entry, default=str))
+
+    def explain_statement(self, conn, statement, parameters):
+        dialect = conn.dialect.name
+        sql = explain_prefix(dialect, self.explain == "analyze") + statement
+        # A raw cursor, so the EXPLAIN isn't seen by the listeners (nor timed, nor logged)
+        cursor = conn.connection.cursor()
+        try:
+            if dialect == "postgresql":
+                # A failing statement would abort the transaction of the request
+                cursor.execute("SAVEPOINT slow_query_explain")
+                try:
+                    cursor.execute(sql, parameters)
+                    rows = cursor.fetchall()
+                except Exception:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    raise
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            else:
+                cursor.execute(sql, parameters)
+                rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        return [list(row) for row in rows]
+
+
+slow_query_log = SlowQueryLog()
+
+
+'''
+log_slow_statement
+    receives the statements timed by the metrics, on every engine, and hands
+    the slow ones to slow_query_log
+'''
+def log_slow_statement(conn, statement, parameters, executemany, elapsed):
+    if slow_query_log.should_log(elapsed):
+        slow_query_log.record(conn, statement, parameters, executemany, elapsed)
+
+
+statement_listeners.append(log_slow_statement)
@@ -0,0 +1,86 @@
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+'''
+gunicorn settings, read from the environment
+    gunicorn --config gunicorn.conf.py
+
+GUNICORN_WORKER_CLASS is sync, gthread (GUNICORN_THREADS threads per worker)
+or gevent, which serves async_wsgi.py (see README, Cooperative Serving Mode).
+The other classes preload the app in the master, so workers fork with the
+code already imported; the database connections of the master are dropped
+in each worker by the fork hook of database/pool.py.
+'''
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+threads = int(os.environ.get("GUNICORN_THREADS", 4)) if worker_class == "gthread" else 1
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+# gevent must patch the standard library before the app is imported, so it isn't preloaded
+wsgi_app = "async_wsgi:application" if worker_class == "gevent" else "wsgi:application"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true" and worker_class != "gevent"
+
+# Workers are replaced after max_requests requests, at different times thanks to the jitter
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Every worker writes its metrics there and /metrics sums them (see metrics/metrics.py).
+# Set here so it is in place before the master (preload) or the workers import the app.
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="capstone-metrics-")
+
+# Connections opened per worker before it accepts requests, 0 disables the warmup
+WARMUP_CONNECTIONS = int(os.environ.get("GUNICORN_WARMUP_CONNECTIONS", os.environ.get("DB_POOL_SIZE", 5)))
+
+
+def on_starting(server):
+    # The files of a previous run in the same directory would be summed with the new ones
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # database/pool.py already does this from os.register_at_fork, for any forking server;
+    # done here too so the preloaded engines are never shared even if that hook is missing
+    from database.pool import dispose_engines_after_fork
+    dispose_engines_after_fork()
+
+
+def post_worker_init(worker):
+    """Opens the pool connections and loads the signing keys before the worker accepts requests."""
+    from auth.auth import jwks_store
+    from database.models import db
+    from database.pool import warm_pool
+
+    if WARMUP_CONNECTIONS:
+        try:
+            with worker.wsgi.app_context():
+                opened = warm_pool(db.engine, WARMUP_CONNECTIONS)
+            worker.log.info("Opened %d database connections", opened)
+        except Exception as e:
+            worker.log.warning("Warming up the database connections failed: %s", e)
+
+    try:
+        jwks_store.refresh()
+        worker.log.info("Loaded the signing keys from %s", jwks_store.url)
+    except Exception as e:
+        worker.log.warning("Loading the signing keys failed, the first request will retry: %s", e)
@@ -0,0 +1,83 @@
+import decimal
+import json
+import os
+import uuid
+from datetime import date
+
+from dotenv import load_dotenv
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+load_dotenv()
+
+
+# orjson (default when installed) or json, the standard library
+JSON_ENCODER = os.environ.get("JSON_ENCODER", "orjson" if orjson is not None else "json")
+# http keeps Flask's "Sat, 05 Oct 2024 00:00:00 GMT" dates, iso writes "2024-10-05"
+JSON_DATE_FORMAT = os.environ.get("JSON_DATE_FORMAT", "http")
+
+'''
+FastJSONProvider
+    the JSON provider of the app, used by jsonify and request.get_json
+    encodes with orjson when it is installed and falls back to the standard
+    library otherwise
+    responses are compact and keep the key order of the dicts they are built
+    from; debug mode indents them and sorts their keys, like Flask does
+'''
+class FastJSONProvider(JSONProvider):
+    mimetype = "application/json"
+
+    def __init__(self, app, encoder=JSON_ENCODER, date_format=JSON_DATE_FORMAT):
+        super().__init__(app)
+        if encoder == "orjson" and orjson is None:
+            raise ValueError("JSON_ENCODER is orjson but orjson is not installed.")
+        if encoder not in ("orjson", "json"):
+            raise ValueError(f"Unknown JSON_ENCODER: {encoder}")
+        if date_format not in ("http", "iso"):
+            raise ValueError(f"Unknown JSON_DATE_FORMAT: {date_format}")
+        self.encoder = encoder
+        self.date_format = date_format
+
+    def default(self, o):
+        if isinstance(o, date):
+            return http_date(o) if self.date_format == "http" else o.isoformat()
+        if isinstance(o, (decimal.Decimal, uuid.UUID)):
+            return str(o)
+        if hasattr(o, "__html__"):
+            return str(o.__html__())
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    def dumps_bytes(self, obj, pretty=False):
+        """Encodes obj as UTF-8 JSON bytes."""
+        if self.encoder == "orjson":
+            option = orjson.OPT_PASSTHROUGH_DATETIME if self.date_format == "http" else 0
+            if pretty:
+                option |= orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=self.default, option=option)
+
+        if pretty:
+            return json.dumps(obj, default=self.default, indent=2, sort_keys=True).encode()
+        return json.dumps(obj, default=self.default, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Custom arguments (cls, indent...) are only understood by the standard library
+            kwargs.setdefault("default", self.default)
+            return json.dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if self.encoder == "orjson" and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = self.dumps_bytes(obj, pretty=self._app.debug)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,176 @@
+import os
+from time import perf_counter
+
+from dotenv import load_dotenv
+from flask import has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+load_dotenv()
+
+
+'''
+Request metrics
+    every request is observed once its response has been sent, streamed
+    bodies included, with the labels method (or "other" for methods the
+    app doesn't serve, so clients can't create label values at will), route
+    (the url rule, or "unmatched") and status
+    the SQL statements and the time spent running them and verifying the
+    token are accumulated per request, so a slow route shows whether its
+    time went to auth, the database or the rest (serialization, compression)
+
+    the statements are timed once for every engine, and each one is then
+    handed to the statement_listeners (e.g. the slow query log) with its
+    duration
+
+    with several processes (gunicorn workers), PROMETHEUS_MULTIPROC_DIR must
+    be set before the app is imported: every process then writes its values
+    to files in that directory and /metrics sums the files of all of them
+'''
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LABELS = ("method", "route", "status")
+METHODS = frozenset(("GET", "HEAD", "POST", "PATCH", "DELETE", "OPTIONS"))
+
+# Called with (conn, statement, parameters, executemany, elapsed) after each statement
+statement_listeners = []
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from receiving the request to sending the last byte of the response.",
+    LABELS, buckets=LATENCY_BUCKETS)
+SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements", "SQL statements run per request.",
+    LABELS, buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+SQL_DURATION = Histogram(
+    "http_request_sql_duration_seconds", "Time spent running SQL statements per request.",
+    LABELS, buckets=LATENCY_BUCKETS)
+AUTH_DURATION = Histogram(
+    "http_request_auth_duration_seconds", "Time spent verifying the token and its permissions per request.",
+    LABELS, buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Bytes of the response body as sent, after compression.",
+    LABELS, buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+
+ENVIRON_KEY = "metrics.request"
+
+
+class RequestMetrics:
+    """What one request spent, observed into the histograms when it ends."""
+
+    def __init__(self, method):
+        self.method = method if method in METHODS else "other"
+        self.route = "unmatched"
+        self.status = "500"
+        self.started = perf_counter()
+        self.sql_statements = 0
+        self.sql_time = 0.0
+        self.auth_time = 0.0
+        self.response_bytes = 0
+
+    def observe(self):
+        labels = (self.method, self.route, self.status)
+        REQUEST_DURATION.labels(*labels).observe(perf_counter() - self.started)
+        SQL_STATEMENTS.labels(*labels).observe(self.sql_statements)
+        SQL_DURATION.labels(*labels).observe(self.sql_time)
+        AUTH_DURATION.labels(*labels).observe(self.auth_time)
+        RESPONSE_SIZE.labels(*labels).observe(self.response_bytes)
+
+
+def current_request_metrics():
+    """The RequestMetrics of the request being handled, or None outside of a request."""
+    if has_request_context():
+        return request.environ.get(ENVIRON_KEY)
+    return None
+
+
+def record_auth_time(seconds):
+    current = current_request_metrics()
+    if current is not None:
+        current.auth_time += seconds
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["metrics_started"].pop()
+    current = current_request_metrics()
+    if current is not None:
+        current.sql_statements += 1
+        current.sql_time += elapsed
+    for listener in statement_listeners:
+        listener(conn, statement, parameters, executemany, elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def discard_statement(context):
+    started = context.connection.info.get("metrics_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+class MeteredBody:
+    """Counts the bytes of a response body and observes the request when the server closes it."""
+
+    def __init__(self, body, current):
+        self.body = body
+        self.current = current
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.current.response_bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.current.observe()
+
+
+class MetricsMiddleware:
+    """WSGI middleware timing each request up to the end of its response body."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        current = environ[ENVIRON_KEY] = RequestMetrics(environ.get("REQUEST_METHOD", "GET"))
+
+        def record_status(status, headers, exc_info=None):
+            current.status = status.split(" ", 1)[0]
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, record_status)
+        except Exception:
+            current.observe()
+            raise
+        return MeteredBody(body, current)
+
+
+def init_metrics(app):
+    """Instruments the requests of app. Called first, so the route is known to the later hooks."""
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+    @app.before_request
+    def record_route():
+        current = current_request_metrics()
+        if current is not None and request.url_rule is not None:
+            current.route = request.url_rule.rule
+
+
+def render_metrics():
+    """The metrics of this process, or of every process in multiprocess mode, in the Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
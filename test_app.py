@@ -1,12 +1,37 @@
+import gzip
 import json
+import sqlite3
+import subprocess
+import sys
+from datetime import date
 from dotenv import load_dotenv
 import os
 import requests
+import tempfile
+import time
 import unittest
+import jwt
+from unittest import mock
+from contextlib import contextmanager
+from cryptography.hazmat.primitives.asymmetric import rsa
 from flask_sqlalchemy import SQLAlchemy
 from config import bearer_tokens
 
-from app import create_app
+from app import create_app, encode_cursor
+from admission import admission
+from auth import auth
+from cache import cache
+from compression import compression
+from database.models import Actor, Movie, db
+from database import models
+from database import pool
+from database import search
+from database import slow_queries
+from database.routing import replica_set
+from json_provider import json_provider
+from metrics import metrics
+from prometheus_client import REGISTRY
+from sqlalchemy import event, exc
 
 load_dotenv()
 database_path = os.getenv("DATABASE_URL")
@@ -262,5 +287,1358 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 403)
         self.assertFalse(data['success'])
 
+def make_signing_key(kid):
+    """Generate an RSA key pair and its public JWK."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    return private_key, jwk
+
+
+def write_jwks(path, *jwks):
+    with open(path, "w") as f:
+        json.dump({"keys": list(jwks)}, f)
+
+
+def mint_token(private_key, kid, permissions, **claims):
+    """Mint an RS256 token accepted by verify_decode_jwt."""
+    payload = {
+        "iss": f"https://{auth.AUTH0_DOMAIN}/",
+        "sub": "auth0|local",
+        "iat": int(time.time()),
+        "exp": int(time.time()) + 3600,
+        "permissions": permissions,
+    }
+    if auth.API_AUDIENCE:
+        payload["aud"] = auth.API_AUDIENCE
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+class JWKSStoreTestCase(unittest.TestCase):
+    """Tests for the process-wide JWKS key cache, run against a local JWKS file"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.jwks_path = os.path.join(self.tmpdir.name, "jwks.json")
+        self.private_key, self.jwk = make_signing_key("key-1")
+        write_jwks(self.jwks_path, self.jwk)
+        self.store = auth.JWKSStore(f"file://{self.jwks_path}", ttl=600, min_refresh_interval=30)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_keys_are_fetched_once(self):
+        for _ in range(5):
+            key = self.store.get_signing_key("key-1")
+
+        self.assertEqual(key.key_id, "key-1")
+        self.assertEqual(self.store.fetch_count, 1)
+
+    def test_unknown_kid_refetches_for_rotation(self):
+        self.store.min_refresh_interval = 0
+        self.store.get_signing_key("key-1")
+
+        _, rotated_jwk = make_signing_key("key-2")
+        write_jwks(self.jwks_path, self.jwk, rotated_jwk)
+
+        self.assertEqual(self.store.get_signing_key("key-2").key_id, "key-2")
+        self.assertEqual(self.store.fetch_count, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.get_signing_key("key-1")
+
+        for _ in range(3):
+            with self.assertRaises(jwt.InvalidTokenError):
+                self.store.get_signing_key("missing")
+
+        self.assertEqual(self.store.fetch_count, 1)
+
+    def test_failed_first_fetch_is_retried_by_the_next_lookup(self):
+        os.remove(self.jwks_path)
+        with self.assertRaises(OSError):
+            self.store.refresh()
+
+        write_jwks(self.jwks_path, self.jwk)
+
+        self.assertEqual(self.store.get_signing_key("key-1").key_id, "key-1")
+
+    def test_failed_background_refresh_is_logged_and_keeps_keys(self):
+        self.store.get_signing_key("key-1")
+        os.remove(self.jwks_path)
+
+        with self.assertLogs("capstone.auth", "WARNING") as logs:
+            self.store._background_refresh()
+
+        self.assertIn("Refreshing the JWKS keys failed", logs.output[0])
+        self.assertEqual(self.store.get_signing_key("key-1").key_id, "key-1")
+
+    def test_verify_decode_jwt_uses_store(self):
+        original_store = auth.jwks_store
+        auth.jwks_store = self.store
+        try:
+            token = mint_token(self.private_key, "key-1", ["view:actors"])
+            payload = auth.verify_decode_jwt(token)
+        finally:
+            auth.jwks_store = original_store
+
+        self.assertEqual(payload["permissions"], ["view:actors"])
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """Tests for the verified-token LRU cache"""
+
+    def setUp(self):
+        self.cache = auth.TokenCache(maxsize=2)
+        self.payload = {"exp": time.time() + 60, "permissions": ["view:actors"]}
+
+    def test_hit_after_put(self):
+        self.assertIsNone(self.cache.get("token"))
+        self.cache.put("token", self.payload)
+        verified = self.cache.get("token")
+
+        self.assertEqual(verified.payload, self.payload)
+        self.assertEqual(verified.permissions, frozenset(["view:actors"]))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_entry_expires_with_token(self):
+        self.cache.put("token", dict(self.payload, exp=time.time() - 1))
+
+        self.assertIsNone(self.cache.get("token"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put("a", self.payload)
+        self.cache.put("b", self.payload)
+        self.cache.get("a")
+        self.cache.put("c", self.payload)
+
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_token_without_exp_is_not_cached(self):
+        self.cache.put("token", {"permissions": []})
+
+        self.assertIsNone(self.cache.get("token"))
+
+
+ALL_PERMISSIONS = [
+    "view:actors", "create:actors", "edit:actors", "delete:actors",
+    "view:movies", "create:movies", "edit:movies", "delete:movies",
+]
+
+
+class LocalAPITestCase(unittest.TestCase):
+    """Runs the API against a temporary SQLite database and locally minted tokens"""
+
+    config = {}
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{self.tmpdir.name}/test.db",
+            **self.config
+        })
+        self.client = self.app.test_client
+
+        jwks_path = os.path.join(self.tmpdir.name, "jwks.json")
+        self.private_key, jwk = make_signing_key("local")
+        write_jwks(jwks_path, jwk)
+        self.original_jwks_store = auth.jwks_store
+        auth.jwks_store = auth.JWKSStore(f"file://{jwks_path}")
+        auth.token_cache.clear()
+
+        self.auth_header = self.make_auth_header(ALL_PERMISSIONS)
+
+    def tearDown(self):
+        auth.jwks_store = self.original_jwks_store
+        auth.token_cache.clear()
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.tmpdir.cleanup()
+
+    @contextmanager
+    def assertQueryCount(self, expected):
+        """Asserts the number of SQL statements issued inside the block."""
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        self.assertEqual(len(statements), expected, "\n".join(statements))
+
+    def make_auth_header(self, permissions, **claims):
+        token = mint_token(self.private_key, "local", permissions, **claims)
+        return {"Authorization": f"Bearer {token}"}
+
+    def seed(self, movies=3, actors_per_movie=2):
+        """Insert movies, each with actors_per_movie actors."""
+        with self.app.app_context():
+            for i in range(movies):
+                movie = Movie(title=f"Movie {i}", release_date=date(2020, 1, 1 + i % 28))
+                db.session.add(movie)
+                db.session.flush()
+                for j in range(actors_per_movie):
+                    db.session.add(Actor(name=f"Actor {i}-{j}", gender="F", age=20 + j, movie_id=movie.id))
+            db.session.commit()
+
+
+class PaginationTestCase(LocalAPITestCase):
+    """Tests for SQL side pagination of the list endpoints"""
+
+    def test_pages_follow_per_page(self):
+        self.seed(movies=5, actors_per_movie=0)
+        res = self.client().get('/movies?page=2&per_page=2', headers=self.auth_header)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie["title"] for movie in data["movies"]], ["Movie 2", "Movie 3"])
+        self.assertNotIn("total", data)
+
+    def test_per_page_is_bounded(self):
+        self.seed(movies=1, actors_per_movie=5)
+        with mock.patch("app.MAX_ITEMS_PER_PAGE", 3):
+            res = self.client().get('/actors?per_page=100000', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.get_json()["actors"]), 3)
+
+    def test_total_on_request(self):
+        self.seed(movies=1, actors_per_movie=3)
+        res = self.client().get('/actors?per_page=1&count=true', headers=self.auth_header)
+        data = res.get_json()
+
+        self.assertEqual(len(data["actors"]), 1)
+        self.assertEqual(data["total"], 3)
+
+    def test_page_past_the_end(self):
+        self.seed(movies=1, actors_per_movie=1)
+        res = self.client().get('/actors?page=5', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_page_is_bounded(self):
+        self.seed(movies=1, actors_per_movie=1)
+        res = self.client().get(f'/actors?page={10 ** 20}', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+
+
+class CursorPaginationTestCase(LocalAPITestCase):
+    """Tests for the keyset (cursor) mode of the list endpoints"""
+
+    def get_all_pages(self, path):
+        names, cursor = [], ""
+        while cursor is not None:
+            res = self.client().get(f'{path}&cursor={cursor}', headers=self.auth_header)
+            self.assertEqual(res.status_code, 200)
+            data = res.get_json()
+            names += [actor["name"] for actor in data["actors"]]
+            cursor = data["next_cursor"]
+        return names
+
+    def test_walks_every_page(self):
+        self.seed(movies=1, actors_per_movie=5)
+        names = self.get_all_pages('/actors?per_page=2')
+
+        self.assertEqual(names, [f"Actor 0-{j}" for j in range(5)])
+
+    def test_pages_are_stable_under_inserts_and_deletes(self):
+        self.seed(movies=1, actors_per_movie=4)
+        res = self.client().get('/actors?per_page=2&cursor=', headers=self.auth_header)
+        cursor = res.get_json()["next_cursor"]
+
+        self.client().delete('/actors/1', headers=self.auth_header)
+        self.client().post('/actors', json={"name": "Late", "age": 30}, headers=self.auth_header)
+        res = self.client().get(f'/actors?per_page=2&cursor={cursor}', headers=self.auth_header)
+
+        self.assertEqual([actor["name"] for actor in res.get_json()["actors"]], ["Actor 0-2", "Actor 0-3"])
+
+    def test_invalid_cursor(self):
+        self.seed(movies=1, actors_per_movie=1)
+        res = self.client().get('/movies?cursor=not-a-cursor', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_cursor_with_a_sort_value_of_the_wrong_type(self):
+        self.seed(movies=1, actors_per_movie=1)
+        cursors = [
+            ('/movies', "release_date", "not a date", 1),
+            ('/movies', "release_date", 20240101, 1),
+            ('/actors', "age", "thirty", 1),
+            ('/actors', "age", True, 1),
+            ('/actors', "name", ["a"], 1),
+            ('/actors', "name", "a", "1"),
+            ('/actors', "name", "a", 2 ** 63),
+            ('/actors', "age", 2 ** 63, 1),
+            ('/actors', "age", -2 ** 63 - 1, 1),
+        ]
+        for path, sort, sort_value, item_id in cursors:
+            cursor = encode_cursor(sort, sort_value, item_id)
+            res = self.client().get(f'{path}?sort={sort}&cursor={cursor}', headers=self.auth_header)
+
+            self.assertEqual(res.status_code, 400, sort_value)
+
+
+class QueryCountTestCase(LocalAPITestCase):
+    """Guards the number of SQL statements issued per endpoint"""
+
+    def test_get_movies_loads_actors_in_bulk(self):
+        self.seed(movies=5, actors_per_movie=3)
+        with self.assertQueryCount(3):
+            res = self.client().get('/movies', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([len(movie["actors"]) for movie in res.get_json()["movies"]], [3] * 5)
+
+    def test_get_movies_by_cursor_loads_actors_in_bulk(self):
+        self.seed(movies=5, actors_per_movie=3)
+        with self.assertQueryCount(3):
+            self.client().get('/movies?cursor=', headers=self.auth_header)
+
+    def test_get_actors(self):
+        self.seed(movies=5, actors_per_movie=3)
+        with self.assertQueryCount(2):
+            self.client().get('/actors', headers=self.auth_header)
+
+    def select_after_update(self):
+        """1 when the database can't return the updated row, so it is selected after the UPDATE."""
+        with self.app.app_context():
+            return 0 if models.supports_update_returning(db.engine.dialect) else 1
+
+    def test_update_movie(self):
+        # UPDATE (... RETURNING), table version bump, SELECT of the movie without RETURNING, SELECT of its actors
+        self.seed(movies=1, actors_per_movie=3)
+        with self.assertQueryCount(3 + self.select_after_update()):
+            res = self.client().patch('/movies/1', json={"title": "Renamed"}, headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["movie"]["title"], "Renamed")
+        self.assertEqual(len(res.get_json()["movie"]["actors"]), 3)
+
+    def test_update_actor(self):
+        self.seed(movies=1, actors_per_movie=3)
+        with self.assertQueryCount(2 + self.select_after_update()):
+            res = self.client().patch('/actors/1', json={"age": 44}, headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["actor"]["age"], 44)
+
+
+class PatchTestCase(LocalAPITestCase):
+    """Tests for the single statement updates of the PATCH endpoints"""
+
+    def patch(self, path, body):
+        return self.client().patch(path, json=body, headers=self.auth_header)
+
+    def test_only_supplied_fields_change(self):
+        self.seed(movies=1, actors_per_movie=1)
+        res = self.patch('/actors/1', {"age": 33})
+        actor = res.get_json()["actor"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["updated"], 1)
+        self.assertEqual((actor["name"], actor["age"], actor["movie_id"]), ("Actor 0-0", 33, 1))
+
+    def test_movie_release_date_is_parsed(self):
+        self.seed(movies=1, actors_per_movie=2)
+        res = self.patch('/movies/1', {"release_date": "2024-10-05"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["edited"], 1)
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Movie, 1).release_date, date(2024, 10, 5))
+        self.assertEqual([actor["name"] for actor in res.get_json()["movie"]["actors"]], ["Actor 0-0", "Actor 0-1"])
+
+    def test_invalid_supplied_field_is_rejected(self):
+        self.seed(movies=1, actors_per_movie=1)
+
+        self.assertEqual(self.patch('/actors/1', {"age": "old"}).status_code, 422)
+        self.assertEqual(self.patch('/movies/1', {"release_date": "soon"}).status_code, 422)
+        self.assertEqual(self.patch('/movies/1', {"title": ""}).status_code, 422)
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Actor, 1).age, 20)
+
+    def test_missing_row_is_404(self):
+        self.assertEqual(self.patch('/actors/99', {"age": 33}).status_code, 404)
+        self.assertEqual(self.patch('/movies/99', {"title": "Nothing"}).status_code, 404)
+
+    def test_update_invalidates_the_embedding_movie(self):
+        self.seed(movies=1, actors_per_movie=1)
+        etag = self.client().get('/movies/1', headers=self.auth_header).headers["ETag"]
+        self.patch('/actors/1', {"name": "Renamed"})
+        res = self.client().get('/movies/1', headers={**self.auth_header, "If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["movie"]["actors"][0]["name"], "Renamed")
+
+    def test_returning_is_supported_on_postgresql(self):
+        from sqlalchemy.dialects import postgresql
+
+        self.assertTrue(models.supports_update_returning(postgresql.dialect()))
+
+
+class SparseFieldsTestCase(LocalAPITestCase):
+    """Tests for ?fields= and ?include= on the list and detail endpoints"""
+
+    def test_fields_restrict_actor_columns(self):
+        self.seed(movies=1, actors_per_movie=2)
+        res = self.client().get('/actors?fields=name,id', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["actors"][0], {"id": 1, "name": "Actor 0-0"})
+
+    def test_fields_drop_actors_and_their_query(self):
+        self.seed(movies=5, actors_per_movie=3)
+        with self.assertQueryCount(2):
+            res = self.client().get('/movies?fields=id,title', headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["movies"][0], {"id": 1, "title": "Movie 0"})
+
+    def test_include_actors_with_fields(self):
+        self.seed(movies=1, actors_per_movie=2)
+        res = self.client().get('/movies/1?fields=title&include=actors', headers=self.auth_header)
+        movie = res.get_json()["movie"]
+
+        self.assertEqual(set(movie), {"title", "actors"})
+        self.assertEqual(len(movie["actors"]), 2)
+
+    def test_empty_include_drops_actors(self):
+        self.seed(movies=1, actors_per_movie=2)
+        res = self.client().get('/movies/1?include=', headers=self.auth_header)
+
+        self.assertEqual(set(res.get_json()["movie"]), {"id", "title", "release_date"})
+
+    def test_fields_with_cursor_sort(self):
+        self.seed(movies=3, actors_per_movie=0)
+        res = self.client().get('/movies?fields=id&sort=-title&per_page=2&cursor=', headers=self.auth_header)
+        data = res.get_json()
+        res = self.client().get(f'/movies?fields=id&sort=-title&per_page=2&cursor={data["next_cursor"]}',
+                                headers=self.auth_header)
+
+        self.assertEqual([movie["id"] for movie in data["movies"]], [3, 2])
+        self.assertEqual(res.get_json()["movies"], [{"id": 1}])
+
+    def test_unknown_field_returns_400(self):
+        res = self.client().get('/actors?fields=name,salary', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(res.get_json()["success"])
+
+    def test_unknown_include_returns_400(self):
+        res = self.client().get('/movies?include=directors', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+
+
+class JSONProviderTestCase(LocalAPITestCase):
+    """Tests for the JSON encoding of responses"""
+
+    def test_dates_keep_http_format(self):
+        self.seed(movies=1, actors_per_movie=0)
+        res = self.client().get('/movies/1', headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["movie"]["release_date"], "Wed, 01 Jan 2020 00:00:00 GMT")
+
+    def test_responses_are_compact_and_keep_field_order(self):
+        self.seed(movies=1, actors_per_movie=1)
+        res = self.client().get('/movies/1', headers=self.auth_header)
+
+        self.assertNotIn(b"\": ", res.data)
+        self.assertEqual(list(res.get_json()["movie"]), ["id", "title", "release_date", "actors"])
+
+    def test_invalid_body_returns_400(self):
+        res = self.client().post('/movies', data="{", content_type="application/json", headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+
+    @unittest.skipIf(json_provider.orjson is None, "orjson is not installed")
+    def test_encoders_write_the_same_json(self):
+        payload = {"movies": [{"id": 1, "title": "Café", "release_date": date(2020, 1, 1)}]}
+        with self.app.app_context():
+            for date_format in ("http", "iso"):
+                fast = json_provider.FastJSONProvider(self.app, "orjson", date_format)
+                plain = json_provider.FastJSONProvider(self.app, "json", date_format)
+                self.assertEqual(fast.dumps(payload), plain.dumps(payload))
+
+
+class ISODateJSONProviderTestCase(LocalAPITestCase):
+    """Tests for JSON_DATE_FORMAT=iso"""
+
+    config = {"JSON_DATE_FORMAT": "iso"}
+
+    def test_dates_use_iso_format(self):
+        self.seed(movies=1, actors_per_movie=0)
+        res = self.client().get('/movies/1', headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["movie"]["release_date"], "2020-01-01")
+
+
+class ConnectionPoolTestCase(LocalAPITestCase):
+    """Tests for the pool settings and statistics"""
+
+    def test_engine_options(self):
+        options = pool.engine_options("postgresql://user@localhost/capstone")
+
+        self.assertIs(options["poolclass"], pool.InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], pool.DB_POOL_SIZE)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(pool.engine_options("sqlite:///capstone.db"), {})
+
+    def test_health_reports_pool_stats(self):
+        pool.pool_stats.reset()
+        res = self.client().get('/health')
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["database"], "ok")
+        self.assertGreaterEqual(data["pool"]["checkouts"], 1)
+        self.assertEqual(data["pool"]["checked_out"], 0)
+
+    def test_checkout_wait_and_timeout_are_recorded(self):
+        pool.pool_stats.reset()
+        queue_pool = pool.InstrumentedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.01)
+        connection = queue_pool.connect()
+        with self.assertRaises(exc.TimeoutError):
+            queue_pool.connect()
+        connection.close()
+
+        stats = pool.pool_stats.snapshot(queue_pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["max_wait_time"], 0.01)
+        self.assertEqual(stats["size"], 1)
+
+    def test_pool_is_replaced_after_fork(self):
+        with self.app.app_context():
+            engine = db.engine
+        old_pool = engine.pool
+        pool.dispose_engines_after_fork()
+
+        self.assertIsNot(engine.pool, old_pool)
+
+
+class MetricsTestCase(LocalAPITestCase):
+    """Tests for the per-route metrics and /metrics"""
+
+    def sample(self, name, route, status="200", method="GET"):
+        value = REGISTRY.get_sample_value(name, {"method": method, "route": route, "status": status})
+        return value or 0.0
+
+    def get(self, path, **kwargs):
+        # Buffered like a server, which closes the response body once it is sent
+        return self.client().get(path, buffered=True, **kwargs)
+
+    def test_request_is_observed_per_route(self):
+        self.seed(movies=5, actors_per_movie=3)
+        count = self.sample("http_request_duration_seconds_count", "/actors")
+        statements = self.sample("http_request_sql_statements_sum", "/actors")
+        size = self.sample("http_response_size_bytes_sum", "/actors")
+
+        res = self.get('/actors', headers=self.auth_header)
+
+        self.assertEqual(self.sample("http_request_duration_seconds_count", "/actors"), count + 1)
+        self.assertEqual(self.sample("http_request_sql_statements_sum", "/actors"), statements + 2)
+        self.assertEqual(self.sample("http_response_size_bytes_sum", "/actors"), size + len(res.data))
+        self.assertGreater(self.sample("http_request_auth_duration_seconds_sum", "/actors"), 0)
+
+    def test_route_template_and_status_are_labels(self):
+        self.seed(movies=1, actors_per_movie=0)
+        count = self.sample("http_request_duration_seconds_count", "/movies/<int:movie_id>", "404")
+        unmatched = self.sample("http_request_duration_seconds_count", "unmatched", "404")
+
+        self.get('/movies/99', headers=self.auth_header)
+        self.get('/nowhere')
+
+        self.assertEqual(self.sample("http_request_duration_seconds_count", "/movies/<int:movie_id>", "404"), count + 1)
+        self.assertEqual(self.sample("http_request_duration_seconds_count", "unmatched", "404"), unmatched + 1)
+
+    def test_unknown_methods_share_one_label(self):
+        other = self.sample("http_request_duration_seconds_count", "unmatched", "405", method="other")
+
+        self.client().open('/actors', method="BREW", buffered=True)
+        self.client().open('/actors', method="PROPFIND", buffered=True)
+
+        self.assertEqual(self.sample("http_request_duration_seconds_count", "unmatched", "405", method="other"), other + 2)
+        self.assertIsNone(REGISTRY.get_sample_value(
+            "http_request_duration_seconds_count", {"method": "BREW", "route": "unmatched", "status": "405"}))
+
+    def test_streamed_response_is_observed_when_sent(self):
+        self.seed(movies=5, actors_per_movie=2)
+        size = self.sample("http_response_size_bytes_sum", "/movies/export")
+
+        res = self.get('/movies/export', headers=self.auth_header)
+
+        self.assertEqual(self.sample("http_response_size_bytes_sum", "/movies/export"), size + len(res.data))
+
+    def test_metrics_endpoint(self):
+        self.get('/health')
+        res = self.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain"))
+        self.assertIn(b'http_request_duration_seconds_count{method="GET",route="/health",status="200"}', res.data)
+
+    def test_metrics_are_summed_over_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            script = (
+                "from prometheus_client import Histogram\n"
+                "Histogram('worker_seconds', 'test', ['route']).labels('/movies').observe(1)\n"
+            )
+            environment = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory}
+            for _ in range(2):
+                subprocess.run([sys.executable, "-c", script], env=environment, check=True)
+
+            with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                body, _ = metrics.render_metrics()
+
+        self.assertIn(b'worker_seconds_count{route="/movies"} 2.0', body)
+
+
+class AdmissionTestCase(LocalAPITestCase):
+    """Tests for the in-flight limit, the queue wait and the quotas per subject"""
+
+    def tearDown(self):
+        admission.admission.configure()
+        super().tearDown()
+
+    def test_in_flight_limit_rejects_with_retry_after(self):
+        self.seed(movies=1, actors_per_movie=1)
+        admission.admission.configure(max_in_flight=1, slot_timeout_ms=10)
+        slots = admission.admission.admit()
+        try:
+            res = self.client().get('/actors', headers=self.auth_header)
+        finally:
+            admission.admission.release(slots)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers["Retry-After"], "1")
+        self.assertFalse(res.get_json()["success"])
+        self.assertEqual(self.client().get('/actors', headers=self.auth_header).status_code, 200)
+        self.assertEqual(admission.admission.stats()["in_flight"], 0)
+
+    def test_rejected_before_the_token_is_verified(self):
+        admission.admission.configure(max_queue_wait_ms=100)
+        queued_since = time.time() - 1
+        res = self.client().get('/actors', headers={"X-Request-Start": f"t={int(queued_since * 1000)}"})
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(admission.admission.stats()["rejected"]["queue_wait"], 1)
+
+    def test_queue_wait_is_not_checked_by_default(self):
+        self.seed(movies=1, actors_per_movie=1)
+        headers = dict(self.auth_header, **{"X-Request-Start": "t=1000000000"})
+        res = self.client().get('/actors', headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_parse_request_start(self):
+        self.assertAlmostEqual(admission.parse_request_start("t=1700000000.5"), 1700000000.5)
+        self.assertAlmostEqual(admission.parse_request_start("t=1700000000500"), 1700000000.5)
+        self.assertAlmostEqual(admission.parse_request_start("1700000000500000"), 1700000000.5)
+        self.assertIsNone(admission.parse_request_start("soon"))
+
+    def test_quota_per_subject(self):
+        self.seed(movies=1, actors_per_movie=1)
+        admission.admission.configure(subject_rate=0.5, subject_burst=2)
+        statuses = [self.client().get('/actors', headers=self.auth_header).status_code for _ in range(3)]
+        other = self.make_auth_header(ALL_PERMISSIONS, sub="auth0|other")
+
+        self.assertEqual(statuses, [200, 200, 429])
+        res = self.client().get('/actors', headers=self.auth_header)
+        self.assertEqual(res.headers["Retry-After"], "2")
+        self.assertEqual(self.client().get('/actors', headers=other).status_code, 200)
+
+    def test_health_is_exempt_and_reports_counters(self):
+        admission.admission.configure(max_in_flight=1, slot_timeout_ms=10)
+        slots = admission.admission.admit()
+        try:
+            res = self.client().get('/health')
+        finally:
+            admission.admission.release(slots)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["admission"]["in_flight"], 1)
+        self.assertEqual(res.get_json()["admission"]["max_in_flight"], 1)
+
+
+class SlowQueryLogTestCase(LocalAPITestCase):
+    """Tests for the slow query log"""
+
+    def setUp(self):
+        super().setUp()
+        self.log_path = os.path.join(self.tmpdir.name, "slow_queries.log")
+        slow_queries.slow_query_log.configure(path=self.log_path, threshold_ms=0)
+
+    def tearDown(self):
+        slow_queries.slow_query_log.configure()
+        super().tearDown()
+
+    def entries(self):
+        with open(self.log_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_select_is_logged_with_route_and_plan(self):
+        self.seed(movies=2, actors_per_movie=3)
+        self.client().get('/actors?movie_id=2&age_min=21', headers=self.auth_header)
+
+        entry = next(entry for entry in self.entries() if "FROM actors" in entry["statement"])
+        self.assertEqual(entry["route"], "/actors")
+        self.assertEqual(entry["method"], "GET")
+        self.assertGreaterEqual(entry["duration_ms"], 0)
+        self.assertIn(2, entry["parameters"])
+        self.assertTrue(entry["plan"])
+
+    def test_text_parameters_are_redacted_and_writes_not_explained(self):
+        self.client().post('/actors', json={"name": "Secret Name", "gender": "F", "age": 30},
+            headers=self.auth_header)
+
+        entry = next(entry for entry in self.entries() if entry["statement"].startswith("INSERT INTO actors"))
+        self.assertNotIn("Secret Name", json.dumps(entry))
+        self.assertIn("<redacted str(11)>", entry["parameters"])
+        self.assertIn(30, entry["parameters"])
+        self.assertNotIn("plan", entry)
+
+    def test_threshold_and_sampling(self):
+        slow_queries.slow_query_log.configure(path=self.log_path, threshold_ms=60000)
+        self.client().get('/actors', headers=self.auth_header)
+        slow_queries.slow_query_log.configure(path=self.log_path, threshold_ms=0, sample_rate=0)
+        self.client().get('/actors', headers=self.auth_header)
+
+        self.assertFalse(os.path.exists(self.log_path))
+
+
+class ReplicaRoutingTestCase(LocalAPITestCase):
+    """Tests for the routing of reads to replicas, with two SQLite files as replicas"""
+
+    def setUp(self):
+        self.replica_dir = tempfile.TemporaryDirectory()
+        self.config = {"DATABASE_REPLICA_URLS": [f"sqlite:///{self.replica_dir.name}/replica_{i}.db" for i in range(2)]}
+        super().setUp()
+        self.seed(movies=1, actors_per_movie=0)
+        with self.app.app_context():
+            for i in range(2):
+                engine = db.engines[f"replica_{i}"]
+                db.metadata.create_all(bind=engine)
+                with engine.begin() as connection:
+                    connection.execute(Movie.__table__.insert(), {"title": f"Replica {i}", "release_date": date(2020, 1, 1)})
+
+    def tearDown(self):
+        with self.app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        replica_set.configure([])
+        super().tearDown()
+        self.replica_dir.cleanup()
+
+    def get_titles(self):
+        res = self.client().get('/movies', headers=self.auth_header)
+        return [movie["title"] for movie in res.get_json()["movies"]]
+
+    def test_reads_go_to_replicas_round_robin(self):
+        titles = self.get_titles() + self.get_titles() + self.get_titles()
+
+        self.assertEqual(sorted(titles[:2]), ["Replica 0", "Replica 1"])
+        self.assertEqual(titles[2], titles[0])
+
+    def test_writes_go_to_primary(self):
+        res = self.client().post('/actors', json={"name": "New", "age": 30}, headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Actor, res.get_json()["created"]).name, "New")
+            for i in range(2):
+                with db.engines[f"replica_{i}"].connect() as connection:
+                    self.assertEqual(connection.execute(Actor.__table__.select()).all(), [])
+
+    def test_patch_reads_its_own_write(self):
+        res = self.client().patch('/movies/1', json={"title": "Renamed"}, headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["movie"]["title"], "Renamed")
+
+    def test_request_reads_from_primary_after_writing(self):
+        with self.app.test_request_context('/movies', method='GET'):
+            self.assertTrue(Movie.query.first().title.startswith("Replica"))
+            db.session.add(Movie(title="Written", release_date=date(2020, 1, 1)))
+            db.session.flush()
+            self.assertEqual([movie.title for movie in Movie.query.order_by(Movie.id)], ["Movie 0", "Written"])
+            db.session.rollback()
+
+    def test_reads_fall_back_to_primary_when_replicas_are_down(self):
+        replica_set.mark_down("replica_0")
+        replica_set.mark_down("replica_1")
+
+        self.assertEqual(self.get_titles(), ["Movie 0"])
+        self.assertEqual(self.client().get('/health').get_json()["replicas"], {"replica_0": "down", "replica_1": "down"})
+
+
+class StartupTestCase(unittest.TestCase):
+    """Tests for the check_revision startup mode"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database_uri = f"sqlite:///{self.tmpdir.name}/test.db"
+        models.checked_databases.clear()
+
+    def tearDown(self):
+        models.checked_databases.clear()
+        self.tmpdir.cleanup()
+
+    def create_app(self):
+        app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_uri, "DB_STARTUP": "check_revision"})
+        with app.app_context():
+            db.engine.dispose()
+        return app
+
+    def stamp(self, revision):
+        with sqlite3.connect(f"{self.tmpdir.name}/test.db") as connection:
+            connection.execute("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)")
+            connection.execute("INSERT INTO alembic_version VALUES (?)", (revision,))
+
+    def test_schema_revision_is_the_alembic_head(self):
+        from alembic.config import Config
+        from alembic.script import ScriptDirectory
+
+        config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+        config.set_main_option("script_location", os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic"))
+        self.assertEqual(ScriptDirectory.from_config(config).get_current_head(), models.SCHEMA_REVISION)
+
+    def test_unmigrated_database_fails(self):
+        with self.assertRaises(models.SchemaRevisionError):
+            self.create_app()
+
+    def test_outdated_database_fails(self):
+        self.stamp("a71f0c2d9e83")
+        with self.assertRaises(models.SchemaRevisionError):
+            self.create_app()
+
+    def test_migrated_database_starts_without_creating_tables(self):
+        self.stamp(models.SCHEMA_REVISION)
+        self.create_app()
+
+        with sqlite3.connect(f"{self.tmpdir.name}/test.db") as connection:
+            tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.assertEqual(tables, ["alembic_version"])
+
+
+class BulkCreateTestCase(LocalAPITestCase):
+    """Tests for POST /actors/bulk and POST /movies/bulk"""
+
+    def test_create_movies_returns_ids_in_order(self):
+        movies = [{"title": f"Bulk {i}", "release_date": "2024-10-05"} for i in range(25)]
+        res = self.client().post('/movies/bulk', json=movies, headers=self.auth_header)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["created"]), 25)
+        with self.app.app_context():
+            titles = [db.session.get(Movie, movie_id).title for movie_id in data["created"]]
+        self.assertEqual(titles, [movie["title"] for movie in movies])
+
+    def test_atomic_mode_creates_nothing_on_error(self):
+        self.seed(movies=1, actors_per_movie=0)
+        actors = [
+            {"name": "Valid", "age": 30, "movie_id": 1},
+            {"name": "No movie", "age": 30, "movie_id": 99},
+            {"name": "No age"},
+        ]
+        res = self.client().post('/actors/bulk', json={"actors": actors}, headers=self.auth_header)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2])
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 0)
+
+    def test_partial_mode_creates_valid_items(self):
+        actors = [{"name": "Valid", "age": 30}, {"name": "No age"}, {"name": "Also valid", "age": 40}]
+        res = self.client().post('/actors/bulk?mode=partial', json=actors, headers=self.auth_header)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(data["created"][1])
+        self.assertEqual(data["errors"], [{"index": 1, "message": "Name and age are required."}])
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 2)
+
+    def test_items_of_the_wrong_type_are_reported_per_item(self):
+        actors = [
+            {"name": ["Not", "text"], "age": 30},
+            {"name": "Valid", "age": 30, "gender": 1},
+            {"name": "Valid", "age": 30, "movie_id": [1]},
+            {"name": "Valid", "age": 30, "movie_id": {"id": 1}},
+            {"name": "Valid", "age": 30},
+        ]
+        res = self.client().post('/actors/bulk?mode=partial', json=actors, headers=self.auth_header)
+        movies = self.client().post('/movies/bulk?mode=partial', json=[{"title": {"x": 1}, "release_date": "2024-01-01"}, {"title": "Valid", "release_date": "2024-01-01"}],
+            headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([error["index"] for error in res.get_json()["errors"]], [0, 1, 2, 3])
+        self.assertEqual(movies.status_code, 200)
+        self.assertEqual(movies.get_json()["errors"], [{"index": 0, "message": "Title must be a string."}])
+
+    def test_bulk_requires_create_permission(self):
+        res = self.client().post('/movies/bulk', json=[{"title": "x", "release_date": "2024-01-01"}],
+            headers=self.make_auth_header(["view:movies"]))
+
+        self.assertEqual(res.status_code, 403)
+
+
+class ImportCommandTestCase(LocalAPITestCase):
+    """Tests for the flask import command"""
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_import_resolves_movies_by_external_id(self):
+        movies = self.write_file("movies.ndjson",
+            '{"external_id": "m1", "title": "A", "release_date": "2020-01-01"}\n'
+            '{"external_id": "m2", "title": "B", "release_date": "2021-01-01"}\n')
+        actors = self.write_file("actors.csv",
+            "external_id,name,age,gender,movie_external_id\n"
+            "a1,X,30,M,m2\n"
+            "a2,Y,31,F,missing\n")
+        runner = self.app.test_cli_runner()
+
+        result = runner.invoke(args=["import", "movies", movies, "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        result = runner.invoke(args=["import", "actors", actors])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with self.app.app_context():
+            actors = Actor.query.all()
+            self.assertEqual([(actor.name, actor.movie.title) for actor in actors], [("X", "B")])
+
+    def test_import_resumes_from_checkpoint(self):
+        movies = self.write_file("movies.ndjson", "".join(
+            f'{{"external_id": "m{i}", "title": "T{i}", "release_date": "2020-01-01"}}\n' for i in range(5)))
+        checkpoint = os.path.join(self.tmpdir.name, "checkpoint.json")
+        with open(checkpoint, "w") as f:
+            json.dump({"kind": "movies", "rows": 3}, f)
+
+        result = self.app.test_cli_runner().invoke(args=["import", "movies", movies, "--checkpoint", checkpoint])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        with self.app.app_context():
+            self.assertEqual([movie.external_id for movie in Movie.query.all()], ["m3", "m4"])
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f)["rows"], 5)
+
+    def test_import_skips_rows_with_values_of_the_wrong_type(self):
+        actors = self.write_file("actors.ndjson",
+            '{"name": "X", "age": [30]}\n'
+            '{"name": "Y", "age": 31, "movie_id": {"id": 1}}\n'
+            '{"name": {"a": 1}, "age": 33}\n'
+            '{"name": "W", "age": 34, "gender": ["F"]}\n'
+            '{"name": "Z", "age": 32}\n')
+        result = self.app.test_cli_runner().invoke(args=["import", "actors", actors])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Row 1 skipped: age must be an integer.", result.output)
+        self.assertIn("Row 2 skipped: movie_id must be an integer.", result.output)
+        self.assertIn("Row 3 skipped: name must be a string.", result.output)
+        self.assertIn("Row 4 skipped: gender must be a string.", result.output)
+        with self.app.app_context():
+            self.assertEqual([actor.name for actor in Actor.query.all()], ["Z"])
+
+    def test_import_skips_movies_with_a_title_of_the_wrong_type(self):
+        movies = self.write_file("movies.ndjson",
+            '{"title": ["x"], "release_date": "2020-01-01"}\n'
+            '{"title": "A", "release_date": "2020-01-01"}\n')
+        result = self.app.test_cli_runner().invoke(args=["import", "movies", movies])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Row 1 skipped: title must be a string.", result.output)
+        with self.app.app_context():
+            self.assertEqual([movie.title for movie in Movie.query.all()], ["A"])
+
+    def test_import_rejects_a_batch_size_below_one(self):
+        movies = self.write_file("movies.ndjson", '{"title": "A", "release_date": "2020-01-01"}\n')
+        result = self.app.test_cli_runner().invoke(args=["import", "movies", movies, "--batch-size", "0"])
+
+        self.assertEqual(result.exit_code, 2)
+
+
+class ExportTestCase(LocalAPITestCase):
+    """Tests for the streaming export endpoints"""
+
+    def test_export_movies_ndjson_with_actors(self):
+        self.seed(movies=3, actors_per_movie=2)
+        with self.assertQueryCount(2):
+            res = self.client().get('/movies/export', headers=self.auth_header)
+            lines = res.get_data(as_text=True).splitlines()
+
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        movies = [json.loads(line) for line in lines]
+        self.assertEqual([movie["title"] for movie in movies], ["Movie 0", "Movie 1", "Movie 2"])
+        self.assertEqual(movies[0]["release_date"], "2020-01-01")
+        self.assertEqual([actor["name"] for actor in movies[2]["actors"]], ["Actor 2-0", "Actor 2-1"])
+
+    def test_export_actors_csv(self):
+        self.seed(movies=1, actors_per_movie=2)
+        res = self.client().get('/actors/export?format=csv', headers=self.auth_header)
+        lines = res.get_data(as_text=True).splitlines()
+
+        self.assertEqual(res.mimetype, "text/csv")
+        self.assertEqual(lines, ["id,name,gender,age,movie_id", "1,Actor 0-0,F,20,1", "2,Actor 0-1,F,21,1"])
+
+    def test_export_invalid_format(self):
+        res = self.client().get('/actors/export?format=xml', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+
+
+class CompressionTestCase(LocalAPITestCase):
+    """Tests for the negotiated compression of responses"""
+
+    def get(self, path, encoding):
+        return self.client().get(path, headers={**self.auth_header, "Accept-Encoding": encoding})
+
+    def test_large_response_is_gzipped(self):
+        self.seed(movies=10, actors_per_movie=5)
+        plain = self.client().get('/movies', headers=self.auth_header)
+        res = self.get('/movies', "gzip")
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        self.assertLess(len(res.data), len(plain.data))
+
+    def test_small_response_is_not_compressed(self):
+        self.seed(movies=1, actors_per_movie=0)
+        res = self.get('/movies/1', "gzip")
+
+        self.assertNotIn("Content-Encoding", res.headers)
+        self.assertTrue(res.get_json()["success"])
+
+    def test_not_compressed_without_accept_encoding(self):
+        self.seed(movies=10, actors_per_movie=5)
+        res = self.get('/movies', "identity")
+
+        self.assertNotIn("Content-Encoding", res.headers)
+
+    def test_streamed_export_is_compressed_incrementally(self):
+        self.seed(movies=5, actors_per_movie=2)
+        plain = self.client().get('/movies/export', headers=self.auth_header)
+        res = self.get('/movies/export', "gzip")
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", res.headers)
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
+    def test_compressed_etag_is_weak_and_revalidates(self):
+        self.seed(movies=10, actors_per_movie=5)
+        res = self.get('/movies', "gzip")
+        etag = res.headers["ETag"]
+
+        self.assertTrue(etag.startswith("W/"))
+        res = self.client().get('/movies', headers={
+            **self.auth_header, "Accept-Encoding": "gzip", "If-None-Match": etag
+        })
+        self.assertEqual(res.status_code, 304)
+
+    def test_quality_values_are_honored(self):
+        self.seed(movies=10, actors_per_movie=5)
+        res = self.get('/movies', "br;q=0, zstd;q=0, gzip;q=0.5")
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+
+    @unittest.skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli_is_preferred(self):
+        self.seed(movies=10, actors_per_movie=5)
+        plain = self.client().get('/movies', headers=self.auth_header)
+        res = self.get('/movies', "gzip, br")
+
+        self.assertEqual(res.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(res.data), plain.data)
+
+
+class FilterAndSortTestCase(LocalAPITestCase):
+    """Tests for the SQL filters and sorts of the list endpoints"""
+
+    def get_names(self, path):
+        res = self.client().get(path, headers=self.auth_header)
+        self.assertEqual(res.status_code, 200)
+        return [actor["name"] for actor in res.get_json()["actors"]]
+
+    def test_filter_actors(self):
+        self.seed(movies=2, actors_per_movie=3)
+
+        self.assertEqual(self.get_names('/actors?movie_id=2&age_min=21'), ["Actor 1-1", "Actor 1-2"])
+        self.assertEqual(self.get_names('/actors?age_max=20'), ["Actor 0-0", "Actor 1-0"])
+
+    def test_filter_movies_by_release_date(self):
+        self.seed(movies=4, actors_per_movie=0)
+        res = self.client().get('/movies?released_after=2020-01-02&released_before=2020-01-03',
+            headers=self.auth_header)
+
+        self.assertEqual([movie["title"] for movie in res.get_json()["movies"]], ["Movie 1", "Movie 2"])
+
+    def test_sort_descending(self):
+        self.seed(movies=2, actors_per_movie=2)
+
+        self.assertEqual(self.get_names('/actors?sort=-age'), ["Actor 1-1", "Actor 0-1", "Actor 1-0", "Actor 0-0"])
+
+    def test_cursor_follows_sort_with_nulls(self):
+        self.seed(movies=1, actors_per_movie=0)
+        with self.app.app_context():
+            for name, age in [("a", 30), ("b", None), ("c", 20), ("d", 30), ("e", None)]:
+                db.session.add(Actor(name=name, gender="F", age=age, movie_id=None))
+            db.session.commit()
+
+        for sort, expected in [("age", "cadbe"), ("-age", "ebdac")]:
+            names, cursor = [], ""
+            while cursor is not None:
+                res = self.client().get(f'/actors?sort={sort}&per_page=2&cursor={cursor}', headers=self.auth_header)
+                names += [actor["name"] for actor in res.get_json()["actors"]]
+                cursor = res.get_json()["next_cursor"]
+            self.assertEqual("".join(names), expected)
+
+    def test_invalid_parameters(self):
+        self.seed(movies=1, actors_per_movie=1)
+
+        for path in ['/actors?sort=gender', '/actors?age_min=old', '/movies?released_after=yesterday']:
+            self.assertEqual(self.client().get(path, headers=self.auth_header).status_code, 400)
+
+    def test_integer_parameters_are_bounded(self):
+        self.seed(movies=1, actors_per_movie=1)
+
+        for name in ["movie_id", "age_min", "age_max"]:
+            for value in [2 ** 63, -2 ** 63 - 1, 10 ** 20]:
+                res = self.client().get(f'/actors?{name}={value}', headers=self.auth_header)
+                self.assertEqual(res.status_code, 400, (name, value))
+        self.assertEqual(self.client().get(f'/actors?age_max={2 ** 63 - 1}', headers=self.auth_header).status_code, 200)
+
+
+class SearchTestCase(LocalAPITestCase):
+    """Tests for GET /search"""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            movie = Movie(title="The Sanh Story", release_date=date(2020, 1, 1))
+            db.session.add(movie)
+            for name in ["Tuan Sanh", "Sanh Tuan", "Thuc Doan", "Sanhita", "100%_real"]:
+                db.session.add(Actor(name=name, gender="M", age=30, movie_id=None))
+            db.session.commit()
+
+    def search(self, q, headers=None):
+        res = self.client().get(f'/search?q={q}', headers=headers or self.auth_header)
+        self.assertEqual(res.status_code, 200)
+        return res.get_json()
+
+    def test_prefix_matches_rank_first(self):
+        data = self.search("sanh")
+
+        self.assertEqual([actor["name"] for actor in data["actors"]], ["Sanhita", "Sanh Tuan", "Tuan Sanh"])
+        self.assertEqual([movie["title"] for movie in data["movies"]], ["The Sanh Story"])
+
+    def test_index_follows_writes(self):
+        self.client().patch('/actors/3', json={"name": "Sanh Doan"}, headers=self.auth_header)
+        self.client().delete('/actors/1', headers=self.auth_header)
+
+        self.assertEqual([actor["name"] for actor in self.search("sanh d")["actors"]], ["Sanh Doan"])
+        self.assertEqual([actor["name"] for actor in self.search("tuan s")["actors"]], [])
+
+    def test_short_and_wildcard_queries(self):
+        self.assertEqual([actor["name"] for actor in self.search("oa")["actors"]], ["Thuc Doan"])
+        self.assertEqual([actor["name"] for actor in self.search("%25_")["actors"]], ["100%_real"])
+
+    def test_movies_need_view_permission(self):
+        data = self.search("sanh", headers=self.make_auth_header(["view:actors"]))
+
+        self.assertNotIn("movies", data)
+
+    def test_etag_depends_on_permissions(self):
+        etag = self.client().get('/search?q=sanh', headers=self.auth_header).headers["ETag"]
+        headers = dict(self.make_auth_header(["view:actors"]), **{"If-None-Match": etag})
+        res = self.client().get('/search?q=sanh', headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("movies", res.get_json())
+
+    def test_falls_back_to_like_without_trigram_tokenizer(self):
+        with mock.patch.object(search, "TRIGRAM_SQLITE_VERSION", (99, 0, 0)):
+            app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{self.tmpdir.name}/old.db"})
+        with app.app_context():
+            db.session.add(Actor(name="Tuan Sanh", gender="M", age=30, movie_id=None))
+            db.session.commit()
+            self.assertFalse(search.has_fts_table(db.session, "actors"))
+        res = app.test_client().get('/search?q=sanh', headers=self.auth_header)
+        with app.app_context():
+            db.engine.dispose()
+
+        self.assertEqual([actor["name"] for actor in res.get_json()["actors"]], ["Tuan Sanh"])
+
+    def test_query_is_required(self):
+        res = self.client().get('/search?q=', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_page_is_bounded(self):
+        res = self.client().get(f'/search?q=sanh&page={10 ** 20}', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 400)
+
+
+class ConditionalGetTestCase(LocalAPITestCase):
+    """Tests for ETags and If-None-Match on the GET endpoints"""
+
+    def test_matching_etag_returns_304_without_querying_rows(self):
+        self.seed(movies=2, actors_per_movie=2)
+        res = self.client().get('/movies', headers=self.auth_header)
+        etag = res.headers["ETag"]
+
+        with self.assertQueryCount(1):
+            res = self.client().get('/movies', headers=dict(self.auth_header, **{"If-None-Match": etag}))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertEqual(res.get_data(), b"")
+
+    def test_write_changes_etag(self):
+        self.seed(movies=1, actors_per_movie=1)
+        etag = self.client().get('/movies', headers=self.auth_header).headers["ETag"]
+
+        self.client().patch('/actors/1', json={"name": "Renamed"}, headers=self.auth_header)
+        res = self.client().get('/movies', headers=dict(self.auth_header, **{"If-None-Match": etag}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+    def test_etag_depends_on_query(self):
+        self.seed(movies=3, actors_per_movie=0)
+        first = self.client().get('/movies?per_page=1', headers=self.auth_header).headers["ETag"]
+        second = self.client().get('/movies?per_page=1&page=2', headers=self.auth_header).headers["ETag"]
+
+        self.assertNotEqual(first, second)
+
+    def test_get_item(self):
+        self.seed(movies=1, actors_per_movie=2)
+        res = self.client().get('/movies/1', headers=self.auth_header)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.get_json()["movie"]["actors"]), 2)
+        self.assertIn("ETag", res.headers)
+        self.assertEqual(self.client().get('/actors/99', headers=self.auth_header).status_code, 404)
+
+    def test_unauthenticated_request_gets_no_304(self):
+        self.seed(movies=1, actors_per_movie=0)
+        etag = self.client().get('/movies', headers=self.auth_header).headers["ETag"]
+        res = self.client().get('/movies', headers={"If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 401)
+
+
+class ResponseCacheTestCase(LocalAPITestCase):
+    """Tests for the response cache of the GET endpoints"""
+
+    def setUp(self):
+        super().setUp()
+        self.original_backend = cache.response_cache.backend
+        cache.response_cache.backend = self.make_backend()
+        cache.response_cache.clear()
+
+    def tearDown(self):
+        cache.response_cache.backend = self.original_backend
+        super().tearDown()
+
+    def make_backend(self):
+        return cache.MemoryBackend(maxsize=2, ttl=60)
+
+    def test_hit_skips_the_database(self):
+        self.seed(movies=2, actors_per_movie=2)
+        first = self.client().get('/movies', headers=self.auth_header)
+        with self.assertQueryCount(1):
+            second = self.client().get('/movies', headers=self.auth_header)
+
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(cache.response_cache.stats()["hits"], 1)
+
+    def test_health_reports_cache_stats(self):
+        self.seed(movies=1, actors_per_movie=0)
+        self.client().get('/movies', headers=self.auth_header)
+        self.client().get('/movies', headers=self.auth_header)
+        data = self.client().get('/health').get_json()
+
+        self.assertEqual(data["response_cache"], {"hits": 1, "misses": 1, "size": 1})
+        self.assertEqual(data["token_cache"]["misses"], 1)
+        self.assertEqual(data["token_cache"]["hits"], 1)
+
+    def test_key_includes_query_and_permissions(self):
+        self.seed(movies=3, actors_per_movie=0)
+        self.client().get('/movies?per_page=1', headers=self.auth_header)
+        self.client().get('/movies?per_page=2', headers=self.auth_header)
+        self.client().get('/movies?per_page=1', headers=self.make_auth_header(["view:movies"]))
+
+        self.assertEqual(cache.response_cache.stats()["hits"], 0)
+
+    def test_apps_on_other_databases_do_not_share_entries(self):
+        # The same writes on both databases, so their table versions match
+        other = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{self.tmpdir.name}/other.db"})
+        for app, title in ((self.app, "This database"), (other, "Other database")):
+            with app.app_context():
+                db.session.add(Movie(title=title, release_date=date(2020, 1, 1)))
+                db.session.commit()
+        self.client().get('/movies/1', headers=self.auth_header)
+
+        res = other.test_client().get('/movies/1', headers=self.auth_header)
+        with other.app_context():
+            db.engine.dispose()
+
+        self.assertEqual(res.get_json()["movie"]["title"], "Other database")
+        self.assertEqual(cache.response_cache.stats()["hits"], 0)
+
+    def test_write_invalidates_dependent_entries_only(self):
+        self.seed(movies=2, actors_per_movie=1)
+        self.client().get('/movies/1', headers=self.auth_header)
+        self.client().get('/movies/2', headers=self.auth_header)
+
+        self.client().patch('/actors/1', json={"name": "Renamed"}, headers=self.auth_header)
+        self.assertEqual(cache.response_cache.stats()["size"], 1)
+        res = self.client().get('/movies/1', headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["movie"]["actors"][0]["name"], "Renamed")
+
+    def test_write_from_another_process_is_not_served_from_the_cache(self):
+        self.seed(movies=1, actors_per_movie=0)
+        etag = self.client().get('/movies/1', headers=self.auth_header).headers["ETag"]
+
+        # Committed without running the change listeners of this process, like another worker
+        with sqlite3.connect(os.path.join(self.tmpdir.name, "test.db")) as connection:
+            connection.execute("UPDATE movies SET title = 'New' WHERE id = 1")
+            connection.execute("UPDATE table_versions SET version = version + 1 WHERE name = 'movies'")
+        res = self.client().get('/movies/1', headers=self.auth_header)
+
+        self.assertEqual(res.get_json()["movie"]["title"], "New")
+        self.assertNotEqual(res.headers["ETag"], etag)
+        revalidated = self.client().get('/movies/1', headers={**self.auth_header, "If-None-Match": res.headers["ETag"]})
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_size_is_bounded(self):
+        self.seed(movies=3, actors_per_movie=0)
+        for movie_id in (1, 2, 3):
+            self.client().get(f'/movies/{movie_id}', headers=self.auth_header)
+
+        self.assertEqual(cache.response_cache.stats()["size"], 2)
+
+
+class SQLiteResponseCacheTestCase(ResponseCacheTestCase):
+    """Runs the response cache tests against the shared SQLite backend"""
+
+    def make_backend(self):
+        return cache.SQLiteBackend(os.path.join(self.tmpdir.name, "cache.db"), maxsize=2, ttl=60)
+
+
 if __name__ == "__main__":
     unittest.main()